@@ -6,8 +6,9 @@ Created on Tue Jun 27 20:55:21 2017
 Low level Maze Class -
     Handles keeping track of the cells
     
-    Maze is stored as a 2D Numpy array of CellType enums. 0 is empty, 1 is a wall, 2 is the start,
-    3 is the destination etc.
+    Maze is stored as a 2D Numpy array of uint8 CellType codes. 0 is empty, 1 is a wall, 2 is the start,
+    3 is the destination etc. Older maze files stored the CellType enums themselves (an object
+    array) and are converted to the compact codes when they are read.
 
 @author: que
 """
@@ -17,13 +18,20 @@ from enum import Enum
 import time
 
 import Rat
-import math
-import pickle
+import MazeTrace
+import hashlib
+import json
+import os.path
+import random
 
 
 MAX_STEPS_MULTIPLIER = 3    # Rat starves after trying more than 3x the numer of cells
 MAX_STEPS_STUCK = 3         # Rat caught if stuck in the same cell for more than three times
 
+CELL_DTYPE = numpy.uint8    # Storage type for the cell codes in Maze.maze_array
+METADATA_VERSION = 1        # Version of the metadata files written by Maze.writeToFile
+RAY_CHUNK_CELLS = 2**20     # Cells scanned at a time for the ray distances, to bound the temporaries
+
 
 class RatStarved(Exception):
     """
@@ -55,12 +63,115 @@ class CellType(Enum):
     START=2
     DESTINATION=3
     
+# Lookup from a stored cell code back to its CellType, indexed by CellType value
+CELL_TYPES = tuple(CellType)
+
+# Heading codes 0-3 stand for the directions 0, 90, 180 and 270 degrees. HEADING_OFFSETS gives the
+# (i,j) offset of the neighbouring cell for each heading code, matching (sin(direction),cos(direction))
+HEADING_OFFSETS = ((0,1),(1,0),(0,-1),(-1,0))
+
 class UpdateType(Enum):
     DIRECTION =0
     LOCATION=1
     EVERYTHING=2
     
+class Outcome(Enum):
+    """
+    How a single run of the maze ended. Maze.run signals STUCK and STARVED with the RatStuck and
+    RatStarved exceptions, the batch tools record the outcome values in arrays instead
+    """
+    SUCCEEDED=0
+    STUCK=1
+    STARVED=2
+    
+    
+class StepTimings(object):
+    """
+    Counters and timers for the phases of Maze.doStep, filled in when instrumentation is on:
+    
+        sense  - building the LocationInfo each rat is shown
+        turn   - the rats' doTurn, also split by rat class
+        move   - moving the rats and checking for stuck rats and the destination
+        views  - updating the views
+        sleep  - waiting for the step delay
+        record - recording the steps in Maze.steps and the trace file
+    """
+    
+    PHASES = ('sense', 'turn', 'move', 'views', 'sleep', 'record')
+    
+    def __init__(self):
+        self.num_steps = 0
+        self.times = dict.fromkeys(self.PHASES, 0.0)
+        self.rat_turns = {}         # Number of doTurn calls per rat class name
+        self.rat_times = {}         # Time in doTurn per rat class name
+        
+    def timePhase(self, phase, func, *args):
+        """
+        Call func(*args), adding the time it takes to the given phase
+        """
+        t0 = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.times[phase] += time.perf_counter() - t0
+            
+    def timeTurn(self, maze, rat):
+        """
+        Show the rat its LocationInfo and let it turn, as Maze.turnRats does, timing both
+        """
+        clock = time.perf_counter
+        t0 = clock()
+        loc = LocationInfo( maze, rat.getLocation(), rat.getDirection())
+        t1 = clock()
+        rat.doTurn(loc)
+        t2 = clock()
+        self.times['sense'] += t1 - t0
+        self.times['turn'] += t2 - t1
+        name = type(rat).__name__
+        self.rat_turns[name] = self.rat_turns.get(name, 0) + 1
+        self.rat_times[name] = self.rat_times.get(name, 0.0) + (t2 - t1)
+        
+    def toDict(self):
+        """
+        Return the counters and timers (in seconds) as a dict
+        """
+        return {'num_steps': self.num_steps,
+                'phases': dict(self.times),
+                'total': sum(self.times.values()),
+                'rats': {name: {'turns': self.rat_turns[name], 'time': self.rat_times[name]}
+                         for name in self.rat_turns}}
+        
+    def toJSON(self):
+        return json.dumps(self.toDict(), indent=2, sort_keys=True)
+        
+        
+def callPhase(phase, func, *args):
+    """
+    Call func(*args) without timing it, standing in for StepTimings.timePhase when
+    instrumentation is off
+    """
+    return func(*args)
+    
     
+def sideWall(turn, doc):
+    """
+    Return a LocationInfo property which is True if there is a wall on the side of the rat given
+    by turn (0 front, 1 right, 2 behind, 3 left)
+    """
+    return property(lambda self: bool(self.wall_mask >> ((self.heading+turn) & 3) & 1), doc=doc)
+
+
+def sideLocation(turn, doc):
+    """
+    Return a LocationInfo property giving the location (x,y) of the cell on the side of the rat
+    given by turn
+    """
+    def location(self):
+        di,dj = HEADING_OFFSETS[(self.heading+turn) & 3]
+        return (self.location[0]+di, self.location[1]+dj)
+    return property(location, doc=doc)
+
+
 class LocationInfo(object):
     """
     Encapsulates the environment around a maze position. There are several properties which 
@@ -70,9 +181,12 @@ class LocationInfo(object):
         left  - the type of the cell to the left
         right - the type of cell behind the rat
         behind - the type of cell directly behind the rat
+        
+    Only the wall mask of the cell is looked up when a LocationInfo is made. The properties are
+    worked out from it when they are asked for, so a rat only pays for what it looks at.
     """
-   
-
+    
+    __slots__ = ('maze', 'location', 'heading', 'wall_mask')
    
     def __init__(self, maze, current_location, direction):
        """
@@ -91,36 +205,107 @@ class LocationInfo(object):
            front_wall, left_wall, right_wall, behind_wall - Booleans indicating if a wall is
             to the front, left, right or behind the current cell. 
            destination - the location (x,y) of the destination cell
+           location - the current location (x,y)
+           
+       Available methods:
+           getDistance(location) - the length of the shortest path from location (default the
+            current location) to the destination
        """
        
-       dir_front = math.radians(direction)
-       dir_right = math.radians(direction+90)
-       dir_behind = math.radians(direction+180)
-       dir_left = math.radians(direction+270)
-       
-       self.front_loc = (current_location[0]+int(math.sin(dir_front)),
-                                     current_location[1]+int(math.cos(dir_front)))      
-       self.front_wall = maze.getCellTypeByLocation(self.front_loc)==CellType.WALL
+       self.maze = maze
+       self.location = current_location
+       self.heading = (direction//90) % 4
+       self.wall_mask = maze.getWallMask().item(current_location)
        
- 
-       self.left_loc = (current_location[0]+int(math.sin(dir_left)),
-                                     current_location[1]+int(math.cos(dir_left)))      
-       self.left_wall = maze.getCellTypeByLocation(self.left_loc)==CellType.WALL
- 
-       self.right_loc = (current_location[0]+int(math.sin(dir_right)),
-                                     current_location[1]+int(math.cos(dir_right)))      
-       self.right_wall = maze.getCellTypeByLocation(self.right_loc)==CellType.WALL
- 
- 
-       self.behind_loc = (current_location[0]+int(math.sin(dir_behind)),
-                                     current_location[1]+int(math.cos(dir_behind)))      
-       self.behind_wall = maze.getCellTypeByLocation(self.behind_loc)==CellType.WALL
+    front_wall = sideWall(0, "True if there is a wall in front")
+    right_wall = sideWall(1, "True if there is a wall to the right")
+    behind_wall = sideWall(2, "True if there is a wall behind")
+    left_wall = sideWall(3, "True if there is a wall to the left")
+    
+    front_loc = sideLocation(0, "The location of the cell in front")
+    right_loc = sideLocation(1, "The location of the cell to the right")
+    behind_loc = sideLocation(2, "The location of the cell behind")
+    left_loc = sideLocation(3, "The location of the cell to the left")
+    
+    @property
+    def destination(self):
+        return self.maze.getDestination()
        
-       self.destination = maze.getDestination()
+    def getDistance(self, location=None):
+        """
+        Return the number of moves on the shortest path from location, or the current location,
+        to the destination, or -1 if the destination can't be reached from there. This is a
+        lookup in the maze's distance field, which is computed once per maze
+        """
+        if location is None:
+            location = self.location
+        return int(self.maze.getDistanceField()[location[0],location[1]])
  
 
 
 
+def getMetadataFileName(filename):
+    """
+    Return the name of the metadata file for the maze file filename: the same name with a .json
+    extension instead of .npy
+    """
+    stem, ext = os.path.splitext(filename)
+    if ext != '.npy':
+        stem = filename     # numpy.save adds .npy to names without it
+    return stem + '.json'
+
+
+def getRayDistanceTable(maze_array, chunk_cells=RAY_CHUNK_CELLS):
+    """
+    Return the ray distances (see Maze.getRayDistances) of the cells in maze_array. Each heading
+    is a cumulative scan along a row or column for the nearest wall, done in int32 for blocks of
+    about chunk_cells cells at a time so that the temporaries stay small however big the maze is
+    """
+    width, height = maze_array.shape
+    dtype = numpy.uint16 if max(width, height) < 2**16 else numpy.int32
+    rays = numpy.zeros((width,height,4), dtype=dtype)
+    wall = CellType.WALL.value
+    
+    # Along the columns (headings 0 and 2) and then the rows (headings 1 and 3):
+    for forward,backward,lines,table in ((0, 2, maze_array, rays),
+                                         (1, 3, maze_array.T, rays.transpose(1,0,2))):
+        num_lines, length = lines.shape
+        index = numpy.arange(length+2, dtype=numpy.int32)
+        cells = index[1:-1]
+        end = numpy.int32(length+1)
+        lines_per_chunk = max(1, chunk_cells // (length+2))
+        for first in range(0, num_lines, lines_per_chunk):
+            chunk = slice(first, first+lines_per_chunk)
+            padded = numpy.ones((len(lines[chunk]),length+2), dtype=bool)   # Walls at the ends
+            padded[:,1:-1] = lines[chunk] == wall
+            
+            # The nearest wall at or after, and at or before, each padded index:
+            after = numpy.minimum.accumulate(numpy.where(padded, index, end)[:,::-1], axis=1)[:,::-1]
+            table[chunk,:,forward] = after[:,2:] - cells - 1
+            del after
+            before = numpy.maximum.accumulate(numpy.where(padded, index, 0), axis=1)
+            table[chunk,:,backward] = cells - before[:,:-2] - 1
+    return rays
+
+
+def makeRandomMaze(max_size, wall_fraction):
+    """
+    Return a maze of random size from 5 up to max_size cells each way, with up to wall_fraction of
+    its cells made walls and the start and destination in random cells, using the random module so
+    that tests can repeat it. Returns None if the start or destination was overwritten
+    """
+    width = random.randint(5,max_size)
+    height = random.randint(5,max_size)
+    maze = Maze(width, height)
+    for iwall in range(random.randint(0, int(width*height*wall_fraction))):
+        maze.setCellType(random.randint(1,width-2), random.randint(1,height-2), CellType.WALL)
+    maze.setCellType(random.randint(1,width-2), random.randint(1,height-2), CellType.DESTINATION)
+    maze.setCellType(random.randint(1,width-2), random.randint(1,height-2), CellType.START)
+    if not maze.hasStart() or not maze.hasDestination() or maze.getStart() == maze.getDestination():
+        return None
+    return maze
+
+
 class Maze(object):
     """
     Basic Maze Object - defines the spaces and walls. Each maze is a 2D array of cells. Each cell
@@ -129,44 +314,60 @@ class Maze(object):
     
     """
     
-    def __init__( self, width=1, height=1, filename=None):
+    def __init__( self, width=1, height=1, filename=None, mmap_mode=None):
         """
         width: An integer representing how many cells wide the maze is
         height: An integer representing how many cells high the maze is
+        filename: A maze file to read instead
+        mmap_mode: If given the file is memory-mapped in this numpy.load mode rather than read
+            into memory (see readFromFile)
         """
         
+        self.start = None
+        self.destination = None
         if filename:
-            self.readFromFile(filename)
+            self.readFromFile(filename, mmap_mode)
         else:
-            self.maze_array = numpy.full((width,height), CellType.SPACE, dtype = CellType)
+            self.maze_array = numpy.full((width,height), CellType.SPACE.value, dtype = CELL_DTYPE)
         
  
+        self.clearCaches()
         self.setBorders()
         self.views = []
         self.rats = []
-        self.start = None
-        self.destination = None
         self.num_steps = 0
         self.step_delay = 0
         self.steps = []
-        
-        try: 
-            self.getDestination()
-            self.getStart()
-        except MazeConfig:
-            pass
+        self.headless = False
+        self.record_steps = True
+        self.trace = None
+        self.timings = None
         
         
     def setBorders( self ):
         """
         All mazes need a boarder of walls around the perimeter. This method
         adds walls for all around the edge.
+        
+        The cells are only written if a border cell isn't already a wall, so a maze file which is
+        memory-mapped read-only stays shared
         """
-        self.maze_array[:,0] = CellType.WALL
-        self.maze_array[0,:] = CellType.WALL
+        wall = CellType.WALL.value
+        maze_array = self.maze_array
+        if ((maze_array[:,0] == wall).all() and (maze_array[0,:] == wall).all() and
+                (maze_array[-1,:] == wall).all() and (maze_array[:,-1] == wall).all()):
+            return
+        
+        self.makeWritable()
+        self.clearCaches()
+        self.maze_array[:,0] = wall
+        self.maze_array[0,:] = wall
 
-        self.maze_array[self.getWidth()-1,:] = CellType.WALL
-        self.maze_array[:,self.getHeight()-1] = CellType.WALL
+        self.maze_array[self.getWidth()-1,:] = wall
+        self.maze_array[:,self.getHeight()-1] = wall
+        
+        # The start or destination may have been on the border
+        self.buildCellIndex()
         
     def onBorder( self, loc):
         """
@@ -187,94 +388,366 @@ class Maze(object):
     
         
     def getCellType(self,x,y):
-        return self.maze_array[x,y]
+        return CELL_TYPES[self.maze_array[x,y]]
     
     def getCellTypeByLocation( self, loc):
         """
         loc is an (i,j) tuple
         """
-        return self.maze_array[loc[0],loc[1]]
+        return CELL_TYPES[self.maze_array[loc[0],loc[1]]]
     
     def setCellType( self, x, y, cell_type):
         
+        self.makeWritable()
+        
+        # Forget the start or destination if it is being replaced
+        if (x,y) == self.start and cell_type != CellType.START:
+            self.start = None
+        if (x,y) == self.destination and cell_type != CellType.DESTINATION:
+            self.destination = None
+        
         # We should only have a single destination or start. So for each one of these 
         # make sure we convert the current destination or start into a space
         if cell_type == CellType.START:
             if self.hasStart():
                 st= self.getStart()
-                self.maze_array[st[0],st[1]] = CellType.SPACE
+                self.maze_array[st[0],st[1]] = CellType.SPACE.value
             self.start=(x,y)
         if cell_type == CellType.DESTINATION:
             if self.hasDestination():
                 dt= self.getDestination()
-                self.maze_array[dt[0],dt[1]] = CellType.SPACE
+                self.maze_array[dt[0],dt[1]] = CellType.SPACE.value
             self.destination=(x,y)
         
         
-        self.maze_array[x,y] = cell_type
+        self.maze_array[x,y] = cell_type.value
+        self.clearCaches()
     
     def writeToFile( self, filename ):
         """
-        Write to Numpy formatted file
+        Write to Numpy formatted file. The cells are written as uint8 CellType codes, and the start
+        and destination to a JSON metadata file alongside (see getMetadataFileName)
         """
-        numpy.save(filename, self.maze_array)
+        numpy.save(filename, self.maze_array.astype(CELL_DTYPE, copy=False))
+        
+        metadata = {'version': METADATA_VERSION,
+                    'shape': list(self.maze_array.shape),
+                    'start': self.start,
+                    'destination': self.destination}
+        with open(getMetadataFileName(filename), 'w') as f:
+            json.dump(metadata, f)
     
-    def readFromFile( self, filename ):
+    def readFromFile( self, filename, mmap_mode=None ):
+        """
+        Read from Numpy formatted file. Both the compact uint8 format and the older
+        format holding an object array of CellType enums can be read
+        
+        With a mmap_mode of 'r' the cells of a compact file are memory-mapped rather than read,
+        so processes opening the same large maze share its pages. The cells are copied into
+        memory if the maze is edited. Older files can't be memory-mapped and are always read
+        """
+        try:
+            self.maze_array = numpy.load(filename, mmap_mode=mmap_mode)
+        except ValueError:
+            # Older maze files are pickled object arrays of CellType enums
+            self.maze_array = self.convertLegacyArray(numpy.load(filename, allow_pickle=True))
+            
+        if self.maze_array.dtype != CELL_DTYPE:
+            self.maze_array = self.maze_array.astype(CELL_DTYPE)
+        self.clearCaches()
+        if not self.readMetadata(getMetadataFileName(filename)):
+            self.buildCellIndex()
+            
+    def readMetadata( self, filename ):
+        """
+        Take the start and destination from a metadata file written by writeToFile. They are
+        checked against the cells, without searching them, and False is returned if the file is
+        missing or doesn't match
+        """
+        try:
+            with open(filename) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return False
+        
+        if metadata.get('version') != METADATA_VERSION:
+            return False
+        if tuple(metadata.get('shape', ())) != self.maze_array.shape:
+            return False
+        
+        locations = {}
+        for key,cell_type in (('start', CellType.START), ('destination', CellType.DESTINATION)):
+            loc = metadata.get(key)
+            # A missing cell can't be checked without a search
+            if loc is None or self.maze_array[loc[0],loc[1]] != cell_type.value:
+                return False
+            locations[key] = (loc[0],loc[1])
+        
+        self.start = locations['start']
+        self.destination = locations['destination']
+        return True
+        
+    def buildCellIndex( self ):
+        """
+        Find the start and destination with a single pass over the cells. Any other start or
+        destination cells are ignored, as the first of each is used
+        """
+        flat = self.maze_array.reshape(-1)
+        special = numpy.flatnonzero(flat >= CellType.START.value)
+        codes = flat[special]
+        
+        self.start = None
+        self.destination = None
+        for cell_type in (CellType.START, CellType.DESTINATION):
+            found = special[codes == cell_type.value]
+            if found.size:
+                i,j = numpy.unravel_index(found[0], self.maze_array.shape)
+                if cell_type == CellType.START:
+                    self.start = (int(i),int(j))
+                else:
+                    self.destination = (int(i),int(j))
+            
+    def makeWritable( self ):
         """
-        Read from Numpy formatted file
+        Copy the cells into memory if they are a read-only memory-mapped file
         """
-        self.maze_array = numpy.load(filename)
+        if not self.maze_array.flags.writeable:
+            self.maze_array = numpy.array(self.maze_array)
+            
+    def convertLegacyArray( self, legacy_array ):
+        """
+        Convert an object array of CellType enums into an array of uint8 CellType codes.
+        Cells are matched by name, since the enums unpickled from an old file need not
+        be the members of this module's CellType (e.g. when it was run as a script).
+        """
+        names = numpy.frompyfunc(lambda cell: getattr(cell, 'name', None), 1, 1)(legacy_array)
+        codes = numpy.zeros(legacy_array.shape, dtype=CELL_DTYPE)
+        matched = numpy.zeros(legacy_array.shape, dtype=bool)
+        for cell_type in CellType:
+            is_type = (names == cell_type.name)
+            codes[is_type] = cell_type.value
+            matched |= is_type
+        if not matched.all():
+            raise MazeConfig("Legacy maze file holds cells that are not CellType members")
+        return codes
         
     def reset(self):
         """
-        Remove all rates and reset for the next simulation
+        Remove all rates and reset for the next simulation. The cells and the cached start,
+        destination and wall mask are kept so the maze can be reused for another run
         """
         self.num_steps =0
         self.rats=[]
+        self.steps = []
         
     def saveSteps( self, filename):
         """
-        Save the steps used for solving the maze to a pickled file
+        Save the steps used for solving the maze to a trace file (see MazeTrace)
         """
-        f = open(filename,'wb')
-        pickle.dump(self.steps, f)
-        f.close()
+        num_rats = len(self.steps[0][0]) if self.steps else len(self.rats)
+        MazeTrace.writeSteps(filename, self.steps, self.getContentHash(), [self.getStart()]*num_rats,
+                             [90]*num_rats)
         
-    def playSavedSteps(self, filename, step_delay=0.0):
+    def recordTrace( self, filename ):
         """
-        Play the saved steps
+        Write the steps of the next run to a trace file as they are taken, rather than keeping
+        them in self.steps. Call this after the rats have been added
         """
+        self.trace = MazeTrace.TraceWriter(filename, self.getContentHash(),
+                                           [rat.getLocation() for rat in self.rats],
+                                           [rat.getDirection() for rat in self.rats])
         
-        f=open(filename, 'rb')
-        self.steps = pickle.load(f)
-        f.close()
+    def closeTrace( self ):
+        """
+        Finish the trace file started by recordTrace, if any
+        """
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
         
+    def openSavedSteps(self, filename):
+        """
+        Open a trace file, or an older pickled step file, for playing back. A rat is added for each
+        rat in the trace and the views are redrawn. Returns the reader (see MazeTrace), which
+        streams the steps from the file as they are needed
+        """
+        trace = MazeTrace.openTrace(filename, self.getStart())
+        if trace.maze_hash is not None and trace.maze_hash != self.getContentHash():
+            trace.close()
+            raise MazeConfig("The steps in {0} were recorded in a different maze".format(filename))
         
         self.rats = []
-        
-        # At a rat for each item of the lists in the first element of steps
-        num_rats = len(self.steps[0][0])
-        for irat in range(num_rats):
+        self.num_steps = 0
+        for irat in range(trace.num_rats):
             self.addRat(Rat.DumbRat())
         
         self.updateViews(UpdateType.EVERYTHING)
+        return trace
+        
+    def showSavedStep(self, trace, step):
+        """
+        Move the rats straight to where they were after the given step of an open trace and
+        update the views once
+        """
+        step_dir, step_pos = trace.getState(step)
+        for irat,rat in enumerate(self.rats):
+            rat.setDirection(step_dir[irat])
+            rat.setLocation(step_pos[irat])
+        
+        self.num_steps = step
+        self.updateViews(UpdateType.DIRECTION)
+        self.updateViews(UpdateType.LOCATION)
+        
+    def playSavedSteps(self, filename, step_delay=0.0, start_step=0):
+        """
+        Play the saved steps from a trace file, or an older pickled step file, starting after
+        start_step steps
+        """
+        
+        trace = self.openSavedSteps(filename)
+        if start_step:
+            self.showSavedStep(trace, start_step)
             
-        for step in self.steps:
+        for step_dir, step_pos in trace.iterSteps(start_step):
            
             for irat,rat in enumerate(self.rats):
-                rat.setDirection(step[0][irat])
+                rat.setDirection(step_dir[irat])
                 
             self.updateViews(UpdateType.DIRECTION) 
-            time.sleep(step_delay)
+            if step_delay:
+                time.sleep(step_delay)
             
             
             for irat,rat in enumerate(self.rats):
-                rat.setLocation(step[1][irat])  # Second element of steps is the location
+                rat.setLocation(step_pos[irat])
                
             self.num_steps += 1
             self.updateViews(UpdateType.LOCATION) 
-            time.sleep(step_delay)
+            if step_delay:
+                time.sleep(step_delay)
+        
+        trace.close()
+                
+        
+    def clearCaches(self):
+        """
+        Forget everything computed from the cells. Called whenever the cells change
+        """
+        self.wall_mask = None
+        self.content_hash = None
+        self.reachable = None
+        self.num_reachable = None
+        self.distance_field = None
+        self.ray_distances = None
+        
+    def getContentHash(self):
+        """
+        Return a hex digest which identifies the size and cells of the maze, for caching results
+        computed for a maze
+        """
+        if self.content_hash is None:
+            digest = hashlib.sha1(repr(self.maze_array.shape).encode())
+            digest.update(numpy.ascontiguousarray(self.maze_array, dtype=CELL_DTYPE).data)
+            self.content_hash = digest.hexdigest()
+        return self.content_hash
+        
+    def getWallMask(self):
+        """
+        Return a uint8 array the same shape as the maze where bit h of each cell is set if the
+        neighbouring cell for heading code h is a wall. Cells outside the maze count as walls.
+        The mask is computed once and kept until the maze cells change.
+        """
+        if self.wall_mask is None:
+            width = self.getWidth()
+            height = self.getHeight()
+            walls = numpy.ones((width+2,height+2), dtype=bool)
+            walls[1:-1,1:-1] = self.maze_array == CellType.WALL.value
+            
+            self.wall_mask = numpy.zeros((width,height), dtype=numpy.uint8)
+            for heading,(di,dj) in enumerate(HEADING_OFFSETS):
+                neighbour_walls = walls[1+di:1+di+width,1+dj:1+dj+height]
+                self.wall_mask |= neighbour_walls.astype(numpy.uint8) << heading
                 
+        return self.wall_mask
+        
+    def getReachable(self):
+        """
+        Return a boolean array the same shape as the maze which is True for the cells a rat can
+        reach from the start, found with a single flood fill (a connected component labelling of
+        the open cells). Kept until the maze cells change. This needs scipy, which is only
+        imported when it is first called so that mazes can be run without it
+        """
+        if self.reachable is None:
+            import scipy.ndimage
+            
+            # The default structure joins cells sharing a side, the moves a rat can make
+            labels = scipy.ndimage.label(self.maze_array != CellType.WALL.value)[0]
+            self.reachable = labels == labels[self.getStart()]
+            self.num_reachable = int(numpy.count_nonzero(self.reachable))
+        return self.reachable
+    
+    def getNumReachableCells(self):
+        """
+        Return the number of cells, including the start, that a rat can reach from the start
+        """
+        self.getReachable()
+        return self.num_reachable
+    
+    def isSolvable(self):
+        """
+        Return True if the destination can be reached from the start. If it can't every rat
+        must get stuck or starve
+        """
+        return bool(self.getReachable()[self.getDestination()])
+        
+    def getDistanceField(self):
+        """
+        Return an int32 array the same shape as the maze giving the number of moves on the
+        shortest path from each cell to the destination, or -1 for walls and cells the destination
+        can't be reached from. It is found with a single breadth first search out from the
+        destination over the graph of open cells, and kept until the maze cells change. Like
+        getReachable this imports scipy when it is first called
+        """
+        if self.distance_field is None:
+            import scipy.sparse
+            from scipy.sparse.csgraph import shortest_path
+            
+            open_cells = self.maze_array != CellType.WALL.value
+            index = numpy.full(self.maze_array.shape, -1, dtype=numpy.int64)
+            index[open_cells] = numpy.arange(numpy.count_nonzero(open_cells))
+            
+            # An edge between each pair of open cells which share a side
+            across = open_cells[:-1,:] & open_cells[1:,:]
+            up = open_cells[:,:-1] & open_cells[:,1:]
+            first = numpy.concatenate([index[:-1,:][across], index[:,:-1][up]])
+            second = numpy.concatenate([index[1:,:][across], index[:,1:][up]])
+            num_open = int(index.max()) + 1
+            graph = scipy.sparse.csr_matrix((numpy.ones(first.size, dtype=numpy.int8),
+                                             (first, second)), shape=(num_open, num_open))
+            
+            distances = shortest_path(graph, directed=False, unweighted=True,
+                                      indices=int(index[self.getDestination()]))
+            self.distance_field = numpy.full(self.maze_array.shape, -1, dtype=numpy.int32)
+            self.distance_field[open_cells] = numpy.where(numpy.isinf(distances), -1, distances)
+        return self.distance_field
+    
+    def getRayDistances(self):
+        """
+        Return an array of shape (width, height, 4) giving the number of cells a rat can move in a
+        straight line from each cell with each heading code before it meets a wall or the edge of
+        the maze, from getRayDistanceTable. The tables are kept until the maze cells change. They
+        are uint16 unless the maze is too big, to keep the tables of very large mazes small
+        """
+        if self.ray_distances is None:
+            self.ray_distances = getRayDistanceTable(self.maze_array)
+        return self.ray_distances
+        
+    def getShortestPathLength(self):
+        """
+        Return the fewest steps any rat could take to reach the destination from the start, or
+        -1 if it can't be reached
+        """
+        return int(self.getDistanceField()[self.getStart()])
         
     def getWidth(self):
         return self.maze_array.shape[0]
@@ -322,46 +795,25 @@ class Maze(object):
         
     def getDestination(self):
         """
-        Return the saved destination location if we have it. Otherwise:
-             
-        Search all maze cells looking for a destination. When it find it return 
-        a position (x,y) in terms of array indices:
+        Return the destination location as a position (x,y) in terms of array indices. It is
+        found when the maze is read and kept up to date by setCellType, so the cells are never
+        searched here. Call buildCellIndex after changing maze_array directly
         """
         
-        if self.destination:
-            return self.destination
-        
-        for i in range(self.maze_array.shape[0]):
-            for j in range(self.maze_array.shape[1]):
-                if self.maze_array[i,j] == CellType.DESTINATION:
-                    self.destination = (i,j)
-                    return self.destination
-                
         if not self.destination:
             raise MazeConfig("Destination was not set for maze")
+        return self.destination
     
     def getStart(self):
         """
-        Return the saved start location if we have it. Otherwise:
-             
-        Search all maze cells looking for a start. When it find it return 
-        a position (x,y) in terms of array indices:
+        Return the start location as a position (x,y) in terms of array indices. Like the
+        destination it is found when the maze is read and kept up to date by setCellType
         """
         
-        if self.start:
-            return self.start
-        
-        for i in range(self.maze_array.shape[0]):
-            for j in range(self.maze_array.shape[1]):
-                if self.maze_array[i,j] == CellType.START:
-                    self.start = (i,j)
-                    return self.start
-                
-        if not self.destination:
+        if not self.start:
             raise MazeConfig("Start was not set for maze")
-        
-        
-        
+        return self.start
+    
     def addRat( self, rat ):
         """
         Add a rat to the list of known rats in the maze
@@ -381,50 +833,201 @@ class Maze(object):
         Do a single step of the Maze simulation. Allow all rats the chance to update their
         direction and then move the rat one step. Returns true if the destination has been 
         reached by any rat
+        
+        In headless mode the views are not updated and there is no delay. The step is only added
+        to self.steps if steps are being recorded, and to the trace file if there is one
+        
+        With instrumentation on each phase of the step is timed in self.timings, otherwise the
+        phases are called directly
         """
-      
-        step_dir= []  # Direction per rat for this step
-        step_pos = [] # Position per rat for this step
+        timings = self.timings
+        if timings is None:
+            timed = callPhase
+        else:
+            timed = timings.timePhase
+            timings.num_steps += 1
+        record = self.record_steps or self.trace is not None
         
-        for rat in self.rats:
-            loc = LocationInfo( self, rat.getLocation(), rat.getDirection())
-            rat.doTurn(loc)
-            step_dir.append(rat.getDirection())
+        step_dir = self.turnRats(record)
         
-        self.updateViews(UpdateType.DIRECTION)
-        time.sleep(self.step_delay)
+        if not self.headless:
+            self.showStep(UpdateType.DIRECTION, timed)
         
-        for rat in self.rats:
-            loc = LocationInfo( self, rat.getLocation(), rat.getDirection())
+        arrived, step_pos = timed('move', self.moveRats, record)
             
-            # Move in front if it's not a wall
-            if not loc.front_wall:
-                rat.setLocation(loc.front_loc)
+        if not arrived and not self.headless:
+            self.showStep(UpdateType.LOCATION, timed)
+        
+        if record:
+            timed('record', self.recordStep, step_dir, step_pos)
+        return arrived
+        
+    def turnRats( self, record ):
+        """
+        Allow all rats the chance to update their direction. Returns the list of their new
+        directions if the step is being recorded
+        """
+        timings = self.timings
+        step_dir = []  # Direction per rat for this step
+        for rat in self.rats:
+            if timings is None:
+                rat.doTurn(LocationInfo( self, rat.getLocation(), rat.getDirection()))
             else:
-                # If in front of a wall then set the current location so we count that we
-                # are stuck:
-                rat.setLocation(rat.getLocation()) 
+                timings.timeTurn(self, rat)
+            if record:
+                step_dir.append(rat.getDirection())
+        return step_dir
+        
+    def showStep( self, update_type, timed ):
+        """
+        Update the views and wait for the step delay. timed calls and times each phase, as in doStep
+        """
+        timed('views', self.updateViews, update_type)
+        if self.step_delay:
+            timed('sleep', time.sleep, self.step_delay)
+        
+    def moveRats( self, record ):
+        """
+        Move all of the rats one step, stopping at the first to reach the destination. Returns
+        whether one did and, if the step is being recorded, the list of the rats' new positions.
+        Raises RatStuck if a rat has been in the same place for too long
+        """
+        step_pos = [] # Position per rat for this step
+        wall_mask = self.getWallMask()
+        destination = self.getDestination()
+        for rat in self.rats:
+            self.moveRat(rat, wall_mask)
          
             if rat.getNumSameLocation() >= MAX_STEPS_STUCK:
                 raise RatStuck("The rat was stuck in the maze and caught by a cat!")
             
             rat_loc = rat.getLocation()
-            step_pos.append(rat_loc)
-            if rat_loc == self.getDestination():
-                self.steps.append((step_dir,step_pos))
-                return True
+            if record:
+                step_pos.append(rat_loc)
+            if rat_loc == destination:
+                return (True, step_pos)
+        return (False, step_pos)
+        
+    def moveRat( self, rat, wall_mask ):
+        """
+        Move the rat one cell in the direction it is facing, looking the cell up directly in the
+        wall mask rather than through a LocationInfo
+        """
+        heading = rat.getHeading()
+        x,y = rat.getLocation()
+        
+        # Move in front if it's not a wall
+        if not wall_mask.item(x,y) >> heading & 1:
+            di,dj = HEADING_OFFSETS[heading]
+            rat.setLocation((x+di, y+dj))
+        else:
+            # If in front of a wall then set the current location so we count that we
+            # are stuck:
+            rat.setLocation((x,y))
+        
+    def skipCorridor( self, rays, max_skip ):
+        """
+        Called after doStep when all of the rats go straight until they meet a wall. Rather than
+        running the steps one at a time, move every rat along the corridor in front of it in one go,
+        as far as the first cell where one of them faces a wall or reaches the destination, or by
+        at most max_skip steps. rays is from getRayDistances.
+        
+        Nothing is skipped unless every rat moved forward in the step just done (a rat which
+        didn't faces a wall), so none can get stuck on the way and the rats end in exactly the
+        state the steps would have left them in. The steps are recorded as doStep would record
+        them. Returns a tuple of the number of steps skipped and whether a rat reached the
+        destination.
+        """
+        dest_x, dest_y = self.getDestination()
+        num_skip = max_skip
+        for rat in self.rats:
+            x,y = rat.getLocation()
+            heading = rat.getHeading()
+            ahead = rays.item(x,y,heading)
+            di,dj = HEADING_OFFSETS[heading]
             
-        self.updateViews(UpdateType.LOCATION)
-        time.sleep(self.step_delay)
+            # Stop on the destination if it is in the corridor:
+            if di == 0 and x == dest_x:
+                to_dest = (dest_y - y)*dj
+            elif dj == 0 and y == dest_y:
+                to_dest = (dest_x - x)*di
+            else:
+                to_dest = 0
+            if 0 < to_dest < ahead:
+                ahead = to_dest
+            num_skip = min(num_skip, ahead)
+        if num_skip <= 0:
+            return (0, False)
+        
+        moves = []
+        first_arrival = None
+        for irat,rat in enumerate(self.rats):
+            x,y = rat.getLocation()
+            di,dj = HEADING_OFFSETS[rat.getHeading()]
+            moves.append((x, y, di, dj, rat.getDirection()))
+            if first_arrival is None and (x + num_skip*di, y + num_skip*dj) == (dest_x, dest_y):
+                first_arrival = irat
+        arrived = first_arrival is not None
+        
+        # doStep stops at the first rat to reach the destination, so the rats after it don't make
+        # the last move:
+        num_last_moved = first_arrival+1 if arrived else len(self.rats)
+        for irat,(rat,(x,y,di,dj,direction)) in enumerate(zip(self.rats, moves)):
+            num_moves = num_skip if irat < num_last_moved else num_skip-1
+            if num_moves > 0:
+                rat.setState(((x + num_moves*di, y + num_moves*dj), rat.getHeading(),
+                              (x + (num_moves-1)*di, y + (num_moves-1)*dj), 0))
+            
+        if self.record_steps or self.trace is not None:
+            step_dir = [move[4] for move in moves]
+            for step in range(1, num_skip+1):
+                step_pos = [(x + step*di, y + step*dj) for x,y,di,dj,direction in moves]
+                if step == num_skip:
+                    del step_pos[num_last_moved:]
+                self.recordStep(step_dir, step_pos)
+                
+        return (num_skip, arrived)
+        
+    def setInstrumentation( self, enabled=True ):
+        """
+        Turn the per-phase counters and timers on or off. Turning them on starts a fresh
+        StepTimings, which carries on across runs until it is turned on again
+        """
+        self.timings = StepTimings() if enabled else None
         
+    def getInstrumentation( self ):
+        """
+        Return the counters and timers collected since instrumentation was turned on, as a dict
+        (see StepTimings.toDict), or None if it is off
+        """
+        return None if self.timings is None else self.timings.toDict()
+        
+    def recordStep( self, step_dir, step_pos ):
+        """
+        Add the directions and positions of the rats after a step to self.steps and the trace
+        """
+        if self.record_steps:
+            self.steps.append((step_dir,step_pos))
+        if self.trace is not None:
+            self.trace.addStep(step_dir, step_pos)
         
-        self.steps.append((step_dir,step_pos))
-        return False
         
+    def setHeadless( self, headless=True ):
+        """
+        In headless mode the simulation doesn't update the views or wait between steps, whatever
+        views are attached or step delay is given to run
+        """
+        self.headless = headless
         
+    def setRecordSteps( self, record_steps=True ):
+        """
+        Set whether the steps of a simulation are recorded in self.steps, ready for saveSteps. Turning
+        this off saves the time and memory used to record every step
+        """
+        self.record_steps = record_steps
 
 
-    def run( self, step_delay=0 ):
+    def run( self, step_delay=0, detect_cycles=True, max_steps=None, skip_corridors=True ):
         """
         Run the maze simulation. At most 3x the number of cells steps will be run, more than that
         and the rat dies of starvation. If the rat is stuck in the same cell for 3 steps then it gets
@@ -433,6 +1036,18 @@ class Maze(object):
         step_delay is the time in seconds we will wait after each turn and each move. This is useful
         when viewing the maze
         
+        max_steps overrides the number of steps after which the rats starve, for example with
+        getMaxSteps(reachable_only=True).
+        
+        If all of the rats are deterministic and detect_cycles is True the rats' states are checked
+        for repeats. Once a state repeats the rats will go round the same loop until they starve, so
+        RatStarved is raised straight away.
+        
+        If skip_corridors is True, the maze is headless without instrumentation and all of the rats
+        go straight until they meet a wall (see Rat.goesStraightUntilWall), the steps along each
+        corridor are skipped in one go with skipCorridor. The number of steps and the recorded steps
+        are exactly as if each step had been run.
+        
         Pre-conditions:
         The maze must be initialised, usually read from a file. There must be a single start and
         destination cell.
@@ -458,18 +1073,80 @@ class Maze(object):
         dest = self.getDestination()
         
     
-        max_steps = MAX_STEPS_MULTIPLIER * self.maze_array.shape[0] * self.maze_array.shape[1]
+        if max_steps is None:
+            max_steps = self.getMaxSteps()
        
+        # Cycle detection (Brent's algorithm) - the state saved after 1, 2, 4, 8... steps is
+        # compared against the state after each step
+        detect_cycles = detect_cycles and all(Rat.isDeterministic(type(rat)) for rat in self.rats)
+        saved_state = None
+        save_interval = 1
+        steps_since_save = 0
+        
+        skip_corridors = (skip_corridors and self.headless and self.timings is None and
+                          all(Rat.goesStraightUntilWall(type(rat)) for rat in self.rats))
+        if skip_corridors:
+            rays = self.getRayDistances()
         
         self.steps = []
-        for istep in range(max_steps):
-            self.num_steps += 1
-            if self.doStep():
-                return self.num_steps   # Reached the destination
-       
+        try:
+            steps_run = 0
+            while steps_run < max_steps:
+                steps_run += 1
+                self.num_steps += 1
+                if self.doStep():
+                    return self.num_steps   # Reached the destination
+                
+                if skip_corridors:
+                    num_skipped, arrived = self.skipCorridor(rays, max_steps - steps_run)
+                    steps_run += num_skipped
+                    self.num_steps += num_skipped
+                    if arrived:
+                        return self.num_steps
+
+                if detect_cycles:
+                    state = self.getRatStates()
+                    if state == saved_state:
+                        raise RatStarved("Rat is going round in circles and would exceed the max number "
+                                         "of steps {0} - rat starved!".format(max_steps))
+                    steps_since_save += 1
+                    if steps_since_save == save_interval:
+                        saved_state = state
+                        save_interval *= 2
+                        steps_since_save = 0
+
+            raise RatStarved("Max number of steps {0} exceeded - rat starved!".format(max_steps))
+        finally:
+            self.closeTrace()
+            
+    def runTrial( self, *args, **kwargs ):
+        """
+        Run the simulation as run does, with the same arguments, and return a tuple of the Outcome
+        and the number of steps rather than raising RatStuck or RatStarved
+        """
+        try:
+            return (Outcome.SUCCEEDED, self.run(*args, **kwargs))
+        except RatStuck:
+            return (Outcome.STUCK, self.getNumberSteps())
+        except RatStarved:
+            return (Outcome.STARVED, self.getNumberSteps())
         
+    def getMaxSteps( self, reachable_only=False ):
+        """
+        Return the number of steps after which the rats starve. This is MAX_STEPS_MULTIPLIER times
+        the number of cells, or with reachable_only the number of cells reachable from the start,
+        which is a tighter limit for mazes with much of their area walled off
+        """
+        if reachable_only:
+            return MAX_STEPS_MULTIPLIER * self.getNumReachableCells()
+        return MAX_STEPS_MULTIPLIER * self.maze_array.shape[0] * self.maze_array.shape[1]
         
-        raise RatStarved("Max number of steps {0} exceeded - rat starved!".format(max_steps))
+    def getRatStates( self ):
+        """
+        Return a tuple of the state (Rat.RatBase.getState) of each rat: its location, heading,
+        last location and stuck count. Together these decide what deterministic rats will do next
+        """
+        return tuple(rat.getState() for rat in self.rats)
         
         
             
@@ -478,6 +1155,8 @@ class Maze(object):
 
 
 def testMaze():
+    import tempfile
+    import shutil
 
     MAZE_WIDTH=10
     MAZE_HEIGHT=15
@@ -486,7 +1165,6 @@ def testMaze():
     START_X = 1
     START_Y = 1
     print("Testing maze")
-    TEST_FILE = "test.npy"
     m = Maze(MAZE_WIDTH, MAZE_HEIGHT)
     assert(m)
     assert(m.getHeight() == MAZE_HEIGHT)
@@ -528,18 +1206,79 @@ def testMaze():
     assert( m.hasStart())
     assert( m.hasDestination())
     
-    m.writeToFile(TEST_FILE)
+    directory = tempfile.mkdtemp()
+    try:
+        TEST_FILE = os.path.join(directory, "test.npy")
+        METADATA_FILE = getMetadataFileName(TEST_FILE)
+        m.writeToFile(TEST_FILE)
     
-    new_maze = Maze(filename=TEST_FILE)
+        new_maze = Maze(filename=TEST_FILE)
   
-    new_maze.readFromFile(TEST_FILE)
-    assert(new_maze.getCellType(0,0) == CellType.WALL )
-    assert(new_maze.getCellType(DEST_X,DEST_Y) == CellType.DESTINATION)
+        new_maze.readFromFile(TEST_FILE)
+        assert(new_maze.getCellType(0,0) == CellType.WALL )
+        assert(new_maze.getCellType(DEST_X,DEST_Y) == CellType.DESTINATION)
+        assert(new_maze.maze_array.dtype == CELL_DTYPE)
+        assert(new_maze.getContentHash() == m.getContentHash())
+    
+        # Older maze files hold an object array of CellType enums:
+        LEGACY_FILE = os.path.join(directory, "test_legacy.npy")
+        legacy_array = numpy.array([[CELL_TYPES[c] for c in row] for row in m.maze_array], dtype=object)
+        numpy.save(LEGACY_FILE, legacy_array, allow_pickle=True)
+        legacy_maze = Maze(filename=LEGACY_FILE)
+        assert(legacy_maze.maze_array.dtype == CELL_DTYPE)
+        assert((legacy_maze.maze_array == m.maze_array).all())
+        assert(legacy_maze.getStart() == (START_X,START_Y))
+        assert(legacy_maze.getDestination() == (DEST_X,DEST_Y))
+        legacy_maze = Maze(filename=LEGACY_FILE, mmap_mode='r')
+        assert(legacy_maze.getStart() == (START_X,START_Y))
+        OtherCellType = Enum('CellType', [(cell_type.name, cell_type.value) for cell_type in CellType])
+        other_array = numpy.array([[OtherCellType[c.name] for c in row] for row in legacy_array], dtype=object)
+        assert((legacy_maze.convertLegacyArray(other_array) == m.maze_array).all())
+        other_array[0,0] = "WALL"
+        try:
+            legacy_maze.convertLegacyArray(other_array)
+            assert(False)
+        except MazeConfig:
+            pass
+    
+        # The start and destination are read from the metadata file, which is checked against the cells:
+        assert(os.path.exists(METADATA_FILE))
+        with open(METADATA_FILE) as f:
+            metadata = json.load(f)
+        assert(tuple(metadata['start']) == (START_X,START_Y))
+        metadata['start'] = [START_X+1,START_Y]
+        with open(METADATA_FILE, 'w') as f:
+            json.dump(metadata, f)
+        assert(Maze(filename=TEST_FILE).getStart() == (START_X,START_Y))
+        os.remove(METADATA_FILE)
+        assert(Maze(filename=TEST_FILE).getDestination() == (DEST_X,DEST_Y))
+    
+        # Memory-mapped mazes share the file until they are edited:
+        mapped_maze = Maze(filename=TEST_FILE, mmap_mode='r')
+        assert(isinstance(mapped_maze.maze_array, numpy.memmap))
+        assert(not mapped_maze.maze_array.flags.writeable)
+        assert(mapped_maze.getStart() == (START_X,START_Y))
+        assert(mapped_maze.getContentHash() == m.getContentHash())
+        mapped_maze.setCellType(2, 2, CellType.WALL)
+        assert(mapped_maze.getCellType(2,2) == CellType.WALL)
+        assert(Maze(filename=TEST_FILE).getCellType(2,2) == CellType.SPACE)
+        del mapped_maze
+    finally:
+        shutil.rmtree(directory)
+    
+    # Replacing the start or destination forgets it:
+    m.setCellType(START_X, START_Y, CellType.SPACE)
+    assert(not m.hasStart())
+    m.setCellType(DEST_X, DEST_Y, CellType.START)
+    assert(not m.hasDestination() and m.getStart() == (DEST_X,DEST_Y))
     
     dumb_rat= Rat.DumbRat()
     new_maze.addRat(dumb_rat)
     
     
+    # Walls behind (heading 2) and to the left (heading 3) of the start cell:
+    assert(new_maze.getWallMask()[START_X,START_Y] == 0b1100)
+    
     loc = LocationInfo( new_maze, (START_X,START_Y), 0) 
     assert( not loc.front_wall)
     assert( loc.left_wall )
@@ -564,15 +1303,137 @@ def testMaze():
     assert( loc.left_wall)
     assert( not loc.right_wall)
     assert( not loc.behind_wall)
+    assert( loc.front_loc == (START_X-1,START_Y) and loc.behind_loc == (START_X+1,START_Y))
+    assert( loc.left_loc == (START_X,START_Y-1) and loc.right_loc == (START_X,START_Y+1))
+    assert( loc.destination == new_maze.getDestination())
+    try:
+        loc.extra = 1
+        assert(False)
+    except AttributeError:
+        pass    # Slots only
     
     
     try:
         new_maze.run()
     except RatStuck:
         pass
+    
+    new_maze.reset()
+    assert(new_maze.getRats() == [] and new_maze.getNumberSteps() == 0 and new_maze.steps == [])
+    
+    # A wall follower which can't reach the destination goes round in circles, which is spotted
+    # long before it starves:
+    loop_maze = Maze(MAZE_WIDTH, MAZE_HEIGHT)
+    loop_maze.setCellType(START_X, START_Y, CellType.START)
+    loop_maze.setCellType(DEST_X, DEST_Y, CellType.DESTINATION)
+    for i in range(DEST_X-1, MAZE_WIDTH):
+        loop_maze.setCellType(i, DEST_Y-1, CellType.WALL)
+    loop_maze.setCellType(DEST_X-1, DEST_Y, CellType.WALL)
+    loop_maze.addRat(Rat.WallFollower())
+    try:
+        loop_maze.run()
+        assert(False)
+    except RatStarved:
+        pass
+    assert(loop_maze.getNumberSteps() < MAZE_WIDTH*MAZE_HEIGHT)
+    
+    # The destination of the loop maze is walled off:
+    assert(not loop_maze.isSolvable())
+    assert(loop_maze.getNumReachableCells() == (MAZE_WIDTH-2)*(MAZE_HEIGHT-2) - 1 - (MAZE_WIDTH-DEST_X) - 1)
+    assert(loop_maze.getMaxSteps(reachable_only=True) < loop_maze.getMaxSteps())
+    assert(new_maze.isSolvable())
+    assert(loop_maze.getShortestPathLength() == -1)
+    loop_maze.setCellType(DEST_X-1, DEST_Y, CellType.SPACE)
+    assert(loop_maze.isSolvable())
+    
+    # Distances to the destination, around the walls:
+    distances = loop_maze.getDistanceField()
+    assert(distances[DEST_X,DEST_Y] == 0 and distances[DEST_X-1,DEST_Y] == 1)
+    assert(distances[DEST_X,DEST_Y-1] == -1 and distances[0,0] == -1)
+    assert(loop_maze.getShortestPathLength() == (DEST_X-START_X) + (DEST_Y-START_Y))
+    loc = LocationInfo(loop_maze, (DEST_X-2,DEST_Y), 90)
+    assert(loc.getDistance() == 2 and loc.getDistance(loc.behind_loc) == 3)
+    
+    # Headless without recording the steps:
+    new_maze.setHeadless()
+    new_maze.setRecordSteps(False)
+    new_maze.addRat(Rat.TurnLeftRat())
+    try:
+        new_maze.run(step_delay=1.0)
+    except (RatStuck, RatStarved):
+        pass
+    assert(new_maze.getNumberSteps() > 0 and new_maze.steps == [])
+    
+    # Instrumented runs give the same results, with the time split by phase and rat class:
+    assert(new_maze.getInstrumentation() is None)
+    new_maze.setRecordSteps(True)
+    for instrument in (False, True):
+        new_maze.reset()
+        new_maze.setInstrumentation(instrument)
+        new_maze.addRat(Rat.WallFollower())
+        new_maze.addRat(Rat.DumbRat())
+        try:
+            new_maze.run()
+        except (RatStuck, RatStarved):
+            pass
+        if instrument:
+            assert(new_maze.steps == steps)
+        steps = new_maze.steps
+    timings = new_maze.getInstrumentation()
+    assert(timings['num_steps'] == new_maze.getNumberSteps())
+    assert(timings['rats']['WallFollower']['turns'] == new_maze.getNumberSteps())
+    assert(timings['phases']['turn'] > 0 and timings['phases']['sleep'] == 0)
+    assert(json.loads(new_maze.timings.toJSON()) == timings)
+    
+    testSkipCorridors()
   
     print("All Tests Passed")
 
 
+def testSkipCorridors():
+    """
+    Check the ray distances against walking each ray, and that skipping along corridors gives
+    exactly the same runs as doing every step, on some random mazes
+    """
+    random.seed(1)
+    outcomes = set()
+    for imaze in range(41):
+        if imaze == 0:
+            # The destination straight ahead of the start, so rats arrive while skipping
+            maze = Maze(10, 5)
+            maze.setCellType(6, 2, CellType.DESTINATION)
+            maze.setCellType(1, 2, CellType.START)
+        else:
+            maze = makeRandomMaze(20, 1/4)
+            if maze is None:
+                continue
+        width, height = maze.getWidth(), maze.getHeight()
+        
+        rays = maze.getRayDistances()
+        for x in range(width):
+            for y in range(height):
+                for heading,(di,dj) in enumerate(HEADING_OFFSETS):
+                    distance = 0
+                    while (0 <= x + (distance+1)*di < width and 0 <= y + (distance+1)*dj < height and
+                           maze.getCellType(x + (distance+1)*di, y + (distance+1)*dj) != CellType.WALL):
+                        distance += 1
+                    assert(rays[x,y,heading] == distance)
+        assert((getRayDistanceTable(maze.maze_array, chunk_cells=1) == rays).all())
+        
+        maze.setHeadless()
+        for rat_types in ((Rat.DumbRat,), (Rat.TurnLeftRat,), (Rat.TurnLeftRat, Rat.DumbRat),
+                          (Rat.DumbRat, Rat.DumbRat), (Rat.DumbRat, Rat.TurnLeftRat, Rat.TurnLeftRat)):
+            runs = []
+            for skip_corridors in (False, True):
+                maze.reset()
+                for rat_type in rat_types:
+                    maze.addRat(rat_type())
+                outcome, num_steps = maze.runTrial(detect_cycles=False, skip_corridors=skip_corridors)
+                runs.append((outcome, num_steps, maze.steps, maze.getRatStates()))
+            assert(runs[0] == runs[1])
+            outcomes.add(runs[0][0])
+    assert(outcomes == set(Outcome))
+
+
 if __name__ == '__main__':
     testMaze()
\ No newline at end of file
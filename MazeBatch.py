@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:40:12 2026
+
+@author: que
+
+Batch simulation of many independent trials of one type of rat in a Maze, each with one or many
+rats.
+
+All of the trials advance together, one step at a time. The position, heading, last position and
+stuck counter of every rat are held in NumPy arrays so the wall sensing and moves are done for all
+of the rats at once. A trial ends exactly as Maze.run would end it: it succeeds when the rat reaches
+the destination, gets stuck after MAX_STEPS_STUCK steps in the same cell and starves after
+MAX_STEPS_MULTIPLIER times the number of cells steps.
+
+"""
+
+import random
+import numpy as np
+
+from Maze import HEADING_OFFSETS, MAX_STEPS_STUCK, LocationInfo, Outcome
+import Rat
+
+
+START_HEADING = 1       # Rats start pointing in direction 90
+
+# New heading code for each turn code (rows) and current heading code (columns)
+TURN_TABLE = np.array(Rat.TURN_HEADINGS, dtype=np.intp)
+MOVE_OFFSETS = np.array(HEADING_OFFSETS, dtype=np.intp)
+
+
+def relativeWallBits(wall_mask, headings):
+    """
+    Rotate wall masks from Maze.getWallMask so that they are relative to the rat's heading:
+    bit 0 is the wall in front, bit 1 the wall to the right, bit 2 the wall behind and bit 3 the
+    wall to the left
+    """
+    wall_mask = wall_mask.astype(np.intp)
+    return ((wall_mask >> headings) | (wall_mask << (4-headings))) & 0xF
+
+
+class ScalarPolicy(object):
+    """
+    Adapts a rat class which only has a scalar doTurn to the batch engine. One rat object is kept
+    per rat and each is shown a LocationInfo and asked to turn, so this is no faster than Maze.run
+    but gives the same results
+    """
+
+    def __init__(self, maze, rat_type, num_rats):
+        self.maze = maze
+        self.rats = np.empty(num_rats, dtype=object)
+        for irat in range(num_rats):
+            rat = rat_type()
+            rat.setLocation(maze.getStart())
+            self.rats[irat] = rat
+
+    def __call__(self, wall_bits, positions, headings, destination, rng):
+        turns = np.empty(len(self.rats), dtype=np.intp)
+        for irat,rat in enumerate(self.rats):
+            heading = int(headings[irat])
+            rat.setHeading(heading)
+            rat.doTurn(LocationInfo(self.maze, rat.getLocation(), rat.getDirection()))
+            turns[irat] = Rat.getTurnCode(heading, rat.getHeading())
+        return turns
+
+    def setLocations(self, positions):
+        """
+        Move each rat to its new location so that its own location and stuck count stay current
+        """
+        for rat,pos in zip(self.rats, positions.tolist()):
+            rat.setLocation(tuple(pos))
+
+    def compact(self, keep):
+        """
+        Drop the rats of the trials that have finished
+        """
+        self.rats = self.rats[keep]
+
+
+class BatchResult(object):
+    """
+    The outcome (an Outcome value) and number of steps of each trial in a batch. Starved trials have
+    the maximum number of steps. finishers gives the index of the rat in each trial whose arrival or
+    getting stuck ended it, or -1 if the rats starved. If a trial was recorded its steps are in the
+    same form as Maze.steps
+    """
+
+    def __init__(self, outcomes, num_steps, max_steps, steps=None, finishers=None):
+        self.outcomes = outcomes
+        self.num_steps = num_steps
+        self.max_steps = max_steps
+        self.steps = steps
+        self.finishers = finishers
+
+    def getNumTrials(self):
+        return len(self.outcomes)
+
+    def getNumOutcome(self, outcome):
+        """
+        Return the number of trials which ended with outcome
+        """
+        return int(np.count_nonzero(self.outcomes == outcome.value))
+
+    def getSuccessfulSteps(self):
+        """
+        Return an array of the number of steps of each successful trial
+        """
+        return self.num_steps[self.outcomes == Outcome.SUCCEEDED.value]
+
+    def getBestTrial(self):
+        """
+        Return the index of the first successful trial with the fewest steps, or None if no trial
+        succeeded
+        """
+        succeeded = self.outcomes == Outcome.SUCCEEDED.value
+        if not succeeded.any():
+            return None
+        return int(np.argmin(np.where(succeeded, self.num_steps, self.max_steps+1)))
+
+
+class BatchSimulator(object):
+    """
+    Runs many independent trials of one type of rat in a maze in lockstep. Each trial has num_rats
+    rats which start at the maze start pointing in direction 90, just like rats added to a Maze, so
+    a single trial with thousands of rats is a swarm.
+
+    As in Maze.doStep all of the rats turn and then they move in the order they were added. The
+    first rat in that order to get stuck or reach the destination ends its trial, before the rats
+    after it have moved.
+
+    Rats with a doBatchTurn make their turns for all rats at once, any other rat class is run
+    through ScalarPolicy. The same seed gives the same results.
+    """
+
+    def __init__(self, maze, rat_type, seed=None, num_rats=1):
+        self.maze = maze
+        self.rat_type = rat_type
+        self.num_rats = num_rats
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+
+    def run(self, num_trials, record_trial=None):
+        """
+        Run num_trials trials and return a BatchResult. If record_trial is the index of a trial
+        then its steps are recorded, and the run stops once that trial has finished.
+        """
+        maze = self.maze
+        num_rats = self.num_rats
+        start = maze.getStart()
+        destination = maze.getDestination()
+        wall_mask = maze.getWallMask()
+        max_steps = maze.getMaxSteps()
+
+        rng = np.random.default_rng(self.seed)
+        policy = Rat.getBatchPolicy(self.rat_type)
+        if policy is None:
+            random.seed(self.seed)
+            policy = ScalarPolicy(maze, self.rat_type, num_trials*num_rats)
+        scalar = isinstance(policy, ScalarPolicy)
+
+        outcomes = np.full(num_trials, Outcome.STARVED.value, dtype=np.int8)
+        num_steps = np.full(num_trials, max_steps, dtype=np.int64)
+        finishers = np.full(num_trials, -1, dtype=np.int64)
+        steps = None if record_trial is None else []
+
+        # State of the rats of the trials still running, num_rats consecutive rats per trial:
+        num_running = num_trials*num_rats
+        trials = np.arange(num_trials)
+        positions = np.tile(np.array(start, dtype=np.intp), (num_running,1))
+        last_positions = np.full((num_running,2), -1, dtype=np.intp)
+        headings = np.full(num_running, START_HEADING, dtype=np.intp)
+        num_same = np.zeros(num_running, dtype=np.intp)
+        dest = np.array(destination, dtype=np.intp)
+
+        for step in range(1, max_steps+1):
+            if trials.size == 0:
+                break
+
+            masks = wall_mask[positions[:,0], positions[:,1]]
+            turns = policy(relativeWallBits(masks, headings), positions, headings, destination, rng)
+            headings = TURN_TABLE[turns, headings]
+
+            # Move forward unless there is a wall in front:
+            moving = ((masks >> headings) & 1) == 0
+            new_positions = positions + MOVE_OFFSETS[headings] * moving[:,None]
+            same = (new_positions == last_positions).all(axis=1)
+            num_same = np.where(same, num_same+1, 0)
+            last_positions = positions
+            positions = new_positions
+            if scalar:
+                policy.setLocations(positions)
+
+            # The first rat of each trial to get stuck or arrive ends it:
+            rat_stuck = (num_same >= MAX_STEPS_STUCK).reshape(-1, num_rats)
+            rat_done = rat_stuck | (positions == dest).all(axis=1).reshape(-1, num_rats)
+            finished = rat_done.any(axis=1)
+            first = rat_done.argmax(axis=1)
+            stuck = finished & rat_stuck[np.arange(trials.size), first]
+            arrived = finished & ~stuck
+
+            if steps is not None:
+                irec = np.searchsorted(trials, record_trial)
+                if irec < trials.size and trials[irec] == record_trial and not stuck[irec]:
+                    rats = slice(irec*num_rats, (irec+1)*num_rats)
+                    num_moved = first[irec]+1 if arrived[irec] else num_rats
+                    steps.append(((headings[rats]*90).tolist(),
+                                  [tuple(pos) for pos in positions[rats][:num_moved].tolist()]))
+
+            if finished.any():
+                outcomes[trials[stuck]] = Outcome.STUCK.value
+                outcomes[trials[arrived]] = Outcome.SUCCEEDED.value
+                num_steps[trials[finished]] = step
+                finishers[trials[finished]] = first[finished]
+
+                if steps is not None and record_trial in trials[finished]:
+                    break
+
+                keep = ~finished
+                trials = trials[keep]
+                keep = np.repeat(keep, num_rats)
+                positions = positions[keep]
+                last_positions = last_positions[keep]
+                headings = headings[keep]
+                num_same = num_same[keep]
+                if scalar:
+                    policy.compact(keep)
+
+        return BatchResult(outcomes, num_steps, max_steps, steps, finishers)
+
+
+def runSwarm(maze, rat_type, num_rats, seed=None, record=False):
+    """
+    Run a single trial of num_rats rats of rat_type in maze together and return a tuple of the
+    Outcome, the number of steps and the index of the rat which finished it (-1 if they starved).
+    With record the steps are put in maze.steps, ready for saveSteps
+    """
+    simulator = BatchSimulator(maze, rat_type, seed, num_rats)
+    result = simulator.run(1, record_trial=0 if record else None)
+    if record:
+        maze.steps = result.steps
+    return (Outcome(int(result.outcomes[0])), int(result.num_steps[0]), int(result.finishers[0]))
+
+
+def testBatch():
+    """
+    Check the batch simulator gives the same results as Maze.run for the deterministic rats
+    """
+    from Maze import Maze, CellType
+
+    print("Testing batch simulator")
+    maze = Maze(12,9)
+    for j in range(1,6):
+        maze.setCellType(5, j, CellType.WALL)
+    maze.setCellType(1, 1, CellType.START)
+    maze.setCellType(9, 2, CellType.DESTINATION)
+
+    for rat_type in (Rat.DumbRat, Rat.TurnLeftRat, Rat.WallFollower):
+        maze.reset()
+        maze.addRat(rat_type())
+        expected = maze.runTrial(detect_cycles=False)
+        expected_steps = maze.steps
+
+        result = BatchSimulator(maze, rat_type, seed=1).run(3, record_trial=1)
+        assert(list(result.outcomes) == [expected[0].value]*3)
+        assert(list(result.num_steps) == [expected[1]]*3)
+        if expected[0] == Outcome.SUCCEEDED:
+            assert(result.steps == expected_steps)
+
+    class ScalarSmellingRat(Rat.SmellingRat):
+        """ Overrides doTurn so runs through ScalarPolicy """
+        def doTurn(self, loc_info):
+            super().doTurn(loc_info)
+
+    assert(Rat.getBatchPolicy(ScalarSmellingRat) is None)
+    result = BatchSimulator(maze, ScalarSmellingRat, seed=2).run(20)
+    assert(result.getNumTrials() == 20)
+
+    # Several rats per trial, compared with Maze.run. The rats don't interfere with each other,
+    # so a trial ends when the first of them (in order) would have ended a single rat trial
+    for rat_types in ((Rat.DumbRat, Rat.TurnLeftRat, Rat.WallFollower), (ScalarSmellingRat,)):
+        for rat_type in rat_types:
+            maze.reset()
+            for irat in range(3):
+                maze.addRat(rat_type())
+            random.seed(4)
+            expected = maze.runTrial(detect_cycles=False)
+            expected_steps = maze.steps
+
+            outcome, num_steps, finisher = runSwarm(maze, rat_type, 3, seed=4, record=True)
+            assert((outcome, num_steps) == expected)
+            if Rat.isDeterministic(rat_type):
+                assert(finisher == (-1 if outcome == Outcome.STARVED else 0))
+            if outcome == Outcome.SUCCEEDED:
+                assert(maze.steps == expected_steps)
+
+    # A swarm of random rats: the trial ends with the first to arrive
+    outcome, num_steps, finisher = runSwarm(maze, Rat.RandomRat, 10000, seed=5)
+    assert(outcome == Outcome.SUCCEEDED and 0 <= finisher < 10000)
+    result = BatchSimulator(maze, Rat.RandomRat, seed=5, num_rats=10000).run(1)
+    assert(result.num_steps[0] == num_steps and result.finishers[0] == finisher)
+
+    # The same seed gives the same results:
+    first = BatchSimulator(maze, Rat.RandomRat, seed=3).run(200)
+    second = BatchSimulator(maze, Rat.RandomRat, seed=3).run(200)
+    assert((first.outcomes == second.outcomes).all())
+    assert((first.num_steps == second.num_steps).all())
+
+    best = first.getBestTrial()
+    if best is not None:
+        replay = BatchSimulator(maze, Rat.RandomRat, seed=3).run(200, record_trial=best)
+        assert(len(replay.steps) == first.num_steps[best])
+
+    print("All tests passed")
+
+
+if __name__ == '__main__':
+    testBatch()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:02:37 2026
+
+@author: que
+
+Benchmarks of the simulation hot paths, with stored baselines to catch regressions.
+
+Each benchmark does some work repeatedly for at least a minimum time and reports a rate: steps
+per second, trials per second and so on. The rates can be saved as a JSON baseline, and later
+runs are compared against it with any rate more than the tolerance below its baseline flagged
+as a regression.
+
+Run with:
+    python MazeBench.py                  compare against MazeBench.json
+    python MazeBench.py --save           save the rates as the new baseline
+    python MazeBench.py --quick          shorter runs on smaller mazes
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+
+from Maze import LocationInfo, RatStuck, RatStarved
+import Rat
+import MazeBatch
+import MazeGenerator
+import MazeStats
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MazeBench.json')
+MIN_TIME = 1.0              # Seconds each benchmark runs for at least
+QUICK_MIN_TIME = 0.2
+TOLERANCE = 0.2             # Fractional slow down flagged as a regression
+MAZE_SIZE = 101             # Size of the benchmark mazes
+QUICK_MAZE_SIZE = 31
+SERIAL_TRIALS = 50          # Trials per chunk run by benchTrials one at a time
+BATCH_TRIALS = 10000        # and by the batch simulator, enough that setting up the batch doesn't dominate
+RAT_TYPES = (Rat.DumbRat, Rat.TurnLeftRat, Rat.RandomRat, Rat.SmellingRat, Rat.SmellingRat2,
+             Rat.WallFollower)
+
+
+def timeRate(work, min_time):
+    """
+    Call work, which returns how many things it did, repeatedly for at least min_time seconds and
+    return the number done per second
+    """
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time or count == 0:
+        count += work()
+        elapsed = time.perf_counter() - start
+    return count / elapsed
+
+
+def benchmarkMaze(size):
+    """
+    Return the maze the benchmarks run in: a seeded cave, which has room for every rat to wander
+    """
+    return MazeGenerator.generateMaze(size, size, 'caves', seed=1)
+
+
+########### The benchmarks
+#
+# Each takes the maze size and minimum time and returns a dict of results, each a tuple of the
+# rate and its unit
+
+def benchLocationInfo(size, min_time):
+    maze = benchmarkMaze(size)
+    start = maze.getStart()
+    maze.getWallMask()
+
+    def work():
+        for direction in (0,90,180,270)*250:
+            LocationInfo(maze, start, direction)
+        return 1000
+    return {'LocationInfo': (timeRate(work, min_time), 'objects/s')}
+
+
+def benchDoStep(size, min_time):
+    """
+    Maze.doStep for each rat class, starting a new run whenever a rat finishes
+    """
+    maze = benchmarkMaze(size)
+    maze.setHeadless()
+    maze.setRecordSteps(False)
+    results = {}
+    for rat_type in RAT_TYPES:
+        random.seed(1)
+        maze.reset()
+        maze.addRat(rat_type())
+
+        def work():
+            for istep in range(100):
+                try:
+                    finished = maze.doStep()
+                except RatStuck:
+                    finished = True
+                if finished:
+                    maze.reset()
+                    maze.addRat(rat_type())
+            return 100
+        results['doStep ' + rat_type.__name__] = (timeRate(work, min_time), 'steps/s')
+    return results
+
+
+def benchRun(size, min_time):
+    """
+    Whole runs with Maze.run of a random rat, a wall follower and a turn left rat, which skips
+    along corridors, recording the steps
+    """
+    maze = benchmarkMaze(size)
+    maze.setHeadless()
+    results = {}
+    for rat_type in (Rat.RandomRat, Rat.WallFollower, Rat.TurnLeftRat):
+        random.seed(1)
+
+        def work():
+            maze.reset()
+            maze.addRat(rat_type())
+            try:
+                maze.run()
+            except (RatStuck, RatStarved):
+                pass
+            return maze.getNumberSteps()
+        results['run ' + rat_type.__name__] = (timeRate(work, min_time), 'steps/s')
+    return results
+
+
+def benchTrials(size, min_time):
+    """
+    Campaigns of trials as run by MazeStats.run_maze_trials, serially and with the batch
+    simulator. The batch simulator is set up once per chunk, so it is given a bigger chunk of
+    trials to measure its throughput rather than the setup
+    """
+    directory = tempfile.mkdtemp()
+    maze_file = os.path.join(directory, 'bench.npy')
+    benchmarkMaze(size).writeToFile(maze_file)
+    results = {}
+    try:
+        for batch, num_trials in ((False, SERIAL_TRIALS), (True, BATCH_TRIALS)):
+            def work():
+                results = MazeStats.run_trial_chunk(num_trials, maze_file, Rat.RandomRat, batch=batch,
+                                                    seed=1)
+                return results.getNumTrials()
+            name = 'trials RandomRat' + (' batch' if batch else '')
+            results[name] = (timeRate(work, min_time), 'trials/s')
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def benchSwarm(size, min_time):
+    """
+    Swarms of 10000 random rats run together by the batch simulator
+    """
+    maze = benchmarkMaze(size)
+
+    def work():
+        outcome, num_steps, finisher = MazeBatch.runSwarm(maze, Rat.RandomRat, 10000, seed=1)
+        return num_steps * 10000
+    return {'swarm RandomRat': (timeRate(work, min_time), 'rat steps/s')}
+
+
+def benchStepFiles(size, min_time):
+    """
+    Writing and playing back saved steps
+    """
+    maze = benchmarkMaze(size)
+    maze.setHeadless()
+    random.seed(1)
+    while len(maze.steps) < 1000:
+        maze.reset()
+        maze.addRat(Rat.RandomRat())
+        try:
+            maze.run()
+        except (RatStuck, RatStarved):
+            pass
+    steps = maze.steps
+
+    directory = tempfile.mkdtemp()
+    step_file = os.path.join(directory, 'bench.stp')
+    try:
+        def save():
+            maze.steps = steps
+            maze.saveSteps(step_file)
+            return len(steps)
+
+        def play():
+            maze.playSavedSteps(step_file)
+            return maze.getNumberSteps()
+
+        return {'saveSteps': (timeRate(save, min_time), 'steps/s'),
+                'playSavedSteps': (timeRate(play, min_time), 'steps/s')}
+    finally:
+        shutil.rmtree(directory)
+
+
+class FakeCanvas(object):
+    """
+    Stands in for a Tk canvas, doing nothing but returning item ids
+    """
+    def __init__(self):
+        self.num_items = 0
+
+    def create_rectangle(self, *args, **kwargs):
+        self.num_items += 1
+        return self.num_items
+    create_image = create_rectangle
+
+    def delete(self, *args):
+        pass
+
+
+def benchDrawMaze(size, min_time):
+    """
+    MazeView.drawMaze, with a rat in the maze, and a canvas which does nothing, so only the view's
+    own work is timed. Skipped if Tk or PIL can't be imported
+    """
+    try:
+        from MazeView import MazeView
+    except ImportError:
+        return {}
+    maze = benchmarkMaze(size)
+    maze.addRat(Rat.WallFollower())
+    view = MazeView.__new__(MazeView)
+    view.maze = maze
+    view.cell_size = 10
+    view.show_grid = True
+    view.canvas = FakeCanvas()
+    view.image_table = {90: None}
+    view.cheese_photo = None
+    view.cheese = None
+    view.start = None
+
+    def work():
+        view.drawMaze()
+        return maze.getWidth() * maze.getHeight()
+    return {'drawMaze': (timeRate(work, min_time), 'cells/s')}
+
+
+BENCHMARKS = (benchLocationInfo, benchDoStep, benchRun, benchTrials, benchSwarm, benchStepFiles,
+              benchDrawMaze)
+
+
+def runBenchmarks(quick=False, benchmarks=BENCHMARKS):
+    """
+    Run the benchmarks and return a dict of the results, each a tuple of the rate and its unit
+    """
+    size = QUICK_MAZE_SIZE if quick else MAZE_SIZE
+    min_time = QUICK_MIN_TIME if quick else MIN_TIME
+    results = {}
+    for benchmark in benchmarks:
+        results.update(benchmark(size, min_time))
+    return results
+
+
+def saveBaseline(results, filename=BASELINE_FILE, quick=False):
+    """
+    Save the results as the baseline for later runs
+    """
+    baseline = {'python': platform.python_version(),
+                'machine': platform.machine(),
+                'quick': quick,
+                'results': {name: {'rate': rate, 'unit': unit} for name, (rate, unit) in results.items()}}
+    with open(filename, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def loadBaseline(filename=BASELINE_FILE, quick=None):
+    """
+    Return the baseline results saved in filename, or None if there isn't one. If quick is given
+    a ValueError is raised unless the baseline was saved from runs of the same kind, as quick and
+    full runs use different maze sizes and can't be compared
+    """
+    try:
+        with open(filename) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        return None
+    if quick is not None and baseline['quick'] != quick:
+        raise ValueError("The baseline in {0} is from {1} runs, so can't be compared with {2} runs"
+                         .format(filename, 'quick' if baseline['quick'] else 'full',
+                                 'quick' if quick else 'full'))
+    return {name: (result['rate'], result['unit']) for name, result in baseline['results'].items()}
+
+
+def compareResults(results, baseline, tolerance=TOLERANCE):
+    """
+    Return a list of (name, rate, baseline rate, ratio) for each result with a baseline, and a
+    list of the names of those more than tolerance slower than their baseline
+    """
+    comparisons = []
+    regressions = []
+    for name, (rate, unit) in sorted(results.items()):
+        if name not in baseline:
+            continue
+        base_rate = baseline[name][0]
+        ratio = rate / base_rate
+        comparisons.append((name, rate, base_rate, ratio))
+        if ratio < 1.0 - tolerance:
+            regressions.append(name)
+    return comparisons, regressions
+
+
+def printResults(results, baseline=None, tolerance=TOLERANCE):
+    """
+    Print the results, compared against the baseline if there is one. Returns the list of the
+    names of the regressions
+    """
+    regressions = []
+    if baseline:
+        comparisons, regressions = compareResults(results, baseline, tolerance)
+        ratios = {name: (base_rate, ratio) for name, rate, base_rate, ratio in comparisons}
+    for name, (rate, unit) in sorted(results.items()):
+        line = "  {0:28s} {1:14,.0f} {2:10s}".format(name, rate, unit)
+        if baseline and name in ratios:
+            base_rate, ratio = ratios[name]
+            line += " baseline {0:14,.0f}  x{1:5.2f}".format(base_rate, ratio)
+            if name in regressions:
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def testBench():
+    """
+    Check the benchmarks run and regressions are flagged
+    """
+    print("Testing benchmarks")
+    results = runBenchmarks(quick=True, benchmarks=(benchLocationInfo, benchDoStep, benchDrawMaze))
+    assert(len(results) >= 1 + len(RAT_TYPES))
+    assert(all(rate > 0 for rate, unit in results.values()))
+
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'bench.json')
+    try:
+        saveBaseline(results, filename, quick=True)
+        baseline = loadBaseline(filename, quick=True)
+        assert(baseline.keys() == results.keys())
+        try:
+            loadBaseline(filename, quick=False)
+            assert(False)
+        except ValueError:
+            pass    # Quick and full runs can't be compared
+    finally:
+        shutil.rmtree(directory)
+
+    slower = {name: (rate*0.5, unit) for name, (rate, unit) in results.items()}
+    comparisons, regressions = compareResults(slower, baseline)
+    assert(sorted(regressions) == sorted(results))
+    comparisons, regressions = compareResults(results, baseline)
+    assert(regressions == [])
+    print("All tests passed")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the maze simulation")
+    parser.add_argument('--save', action='store_true', help="save the rates as the new baseline")
+    parser.add_argument('--quick', action='store_true', help="shorter runs on smaller mazes")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline file")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="fractional slow down flagged as a regression")
+    parser.add_argument('--test', action='store_true', help="run the self test")
+    args = parser.parse_args()
+
+    if args.test:
+        testBench()
+    else:
+        try:
+            baseline = None if args.save else loadBaseline(args.baseline, args.quick)
+        except ValueError as error:
+            print(error)
+            raise SystemExit(2)
+        results = runBenchmarks(args.quick)
+        regressions = printResults(results, baseline, args.tolerance)
+        if args.save:
+            saveBaseline(results, args.baseline, args.quick)
+            print("Saved baseline to {0}".format(args.baseline))
+        elif regressions:
+            print("{0} regressions".format(len(regressions)))
+            raise SystemExit(1)
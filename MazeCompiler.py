@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:05:31 2026
+
+@author: que
+
+Compiles deterministic rats into transition tables.
+
+A deterministic rat's next turn depends only on its cell, its heading and the LocationInfo, so
+the whole of its behavior in a maze is a table giving the next state (cell and heading) for each
+state. Once the table is built a run is just a walk through it, with no calls to doTurn. Tables
+are cached for each maze content and rat class, so a rat can be scored over many mazes cheaply.
+
+A state is cell*4 + heading code, where cell = i*height + j.
+
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+from Maze import HEADING_OFFSETS, MAX_STEPS_STUCK, LocationInfo, Maze, Outcome
+import MazeBatch
+import Rat
+
+
+MAX_CACHED_TABLES = 16      # Number of transition tables kept in TABLE_CACHE
+
+# Recently used transition tables keyed by (maze content hash, rat class)
+TABLE_CACHE = OrderedDict()
+
+
+class TransitionTable(object):
+    """
+    The next state for each state of a deterministic rat in a maze, filled in as states are
+    reached. For a rat with a doBatchTurn the states of all of the cells reachable from the start
+    are computed at once the first time one of them is needed, and any other state on its own.
+    For other rats doTurn is called the first time each state is reached. Either way the walled
+    off parts of the maze are never worked out, however many times the table is walked
+
+    The table keeps its own copy of everything it reads from the maze, as it is shared by every
+    maze with the same content and the maze it was built from may be edited later
+    """
+
+    def __init__(self, maze, rat_type):
+        if not Rat.isDeterministic(rat_type):
+            raise ValueError("{0} is not a deterministic rat".format(rat_type.__name__))
+
+        self.rat_type = rat_type
+        self.height = maze.getHeight()
+        self.num_states = maze.getWidth() * self.height * 4
+        self.move_offsets = [di*self.height + dj for di,dj in HEADING_OFFSETS]
+        self.wall_mask = maze.getWallMask().ravel().copy()
+        self.destination = maze.getDestination()
+
+        self.next_state = np.full(self.num_states, -1, dtype=np.int64)
+        self.policy = Rat.getBatchPolicy(rat_type)
+        if self.policy is None:
+            # doTurn is shown LocationInfos on a private copy of the maze
+            self.rat = rat_type()
+            self.maze = Maze(maze.getWidth(), self.height)
+            self.maze.maze_array = maze.maze_array.copy()
+            self.maze.clearCaches()
+            self.maze.start = maze.getStart()
+            self.maze.destination = self.destination
+            self.reachable = None
+        else:
+            self.rat = None
+            self.maze = None
+            self.reachable = maze.getReachable().ravel().copy()
+        self.reachable_compiled = False
+
+    def compileStates(self, state):
+        """
+        Compute the next state of state with the vectorized policy, along with those of all of
+        the states of the cells reachable from the start if state is one of them. A deterministic
+        rat's path is a single chain of states, so they are done in one call rather than state
+        by state
+        """
+        reachable = self.reachable
+        if reachable[state // 4] and not self.reachable_compiled:
+            states = (np.flatnonzero(reachable)[:,None]*4 + np.arange(4)).ravel()
+            self.reachable_compiled = True
+        else:
+            states = np.array([state])
+
+        cells = states // 4
+        headings = states % 4
+        positions = np.stack(np.divmod(cells, self.height), axis=1)
+
+        masks = self.wall_mask[cells].astype(np.intp)
+        turns = self.policy(MazeBatch.relativeWallBits(masks, headings), positions, headings,
+                            self.destination, None)
+        new_headings = MazeBatch.TURN_TABLE[turns, headings]
+
+        moving = ((masks >> new_headings) & 1) == 0
+        next_cells = cells + np.array(self.move_offsets)[new_headings] * moving
+        self.next_state[states] = next_cells*4 + new_headings
+
+    def getNextState(self, state):
+        """
+        Return the state after one step from state
+        """
+        next_state = self.next_state.item(state)
+        if next_state < 0 and self.policy is not None:
+            self.compileStates(state)
+            next_state = self.next_state.item(state)
+        elif next_state < 0:
+            # Not reached before - ask the rat
+            cell, heading = divmod(state, 4)
+            location = divmod(cell, self.height)
+            rat = self.rat
+            rat.setHeading(heading)
+            rat.location = location
+            rat.doTurn(LocationInfo(self.maze, location, rat.getDirection()))
+            heading = rat.getHeading()
+
+            if not (self.wall_mask.item(cell) >> heading) & 1:
+                cell += self.move_offsets[heading]
+            next_state = cell*4 + heading
+            self.next_state[state] = next_state
+        return next_state
+
+    def evaluate(self, maze, start=None, max_steps=None):
+        """
+        Walk the table for a run in maze, which must have the content the table was compiled for,
+        from start (default the maze start) with the rat pointing in direction 90, exactly as
+        Maze.run would run the rat. max_steps defaults to maze.getMaxSteps(). Returns a tuple of
+        the Outcome and number of steps; starved runs have max_steps steps.
+
+        Once a state repeats the rat is going round in circles. Stuck and success depend on at most
+        the last five positions, so if neither has happened three steps after the repeat neither
+        ever will and the rat starves.
+        """
+        if start is None:
+            start = maze.getStart()
+        if max_steps is None:
+            max_steps = maze.getMaxSteps()
+        destination = maze.getDestination()
+        dest_cell = destination[0]*self.height + destination[1]
+
+        state = (start[0]*self.height + start[1])*4 + MazeBatch.START_HEADING
+        cell = state // 4
+        last_cell = -1
+        num_same = 0
+
+        # Brent's cycle detection, as in Maze.run
+        saved_state = -1
+        save_interval = 1
+        steps_since_save = 0
+        last_step = max_steps
+
+        for step in range(1, max_steps+1):
+            state = self.getNextState(state)
+            new_cell = state // 4
+            if new_cell == last_cell:
+                num_same += 1
+            else:
+                num_same = 0
+            last_cell = cell
+            cell = new_cell
+
+            if num_same >= MAX_STEPS_STUCK:
+                return (Outcome.STUCK, step)
+            if cell == dest_cell:
+                return (Outcome.SUCCEEDED, step)
+            if step == last_step:
+                break
+
+            if last_step == max_steps:
+                if state == saved_state:
+                    last_step = min(max_steps, step + 3)
+                steps_since_save += 1
+                if steps_since_save == save_interval:
+                    saved_state = state
+                    save_interval *= 2
+                    steps_since_save = 0
+
+        return (Outcome.STARVED, max_steps)
+
+
+def compileRat(maze, rat_type):
+    """
+    Return the TransitionTable for rat_type in maze, from the cache if it has been compiled for a
+    maze with the same content before
+    """
+    key = (maze.getContentHash(), rat_type)
+    table = TABLE_CACHE.get(key)
+    if table is None:
+        table = TransitionTable(maze, rat_type)
+        TABLE_CACHE[key] = table
+        if len(TABLE_CACHE) > MAX_CACHED_TABLES:
+            TABLE_CACHE.popitem(last=False)
+    else:
+        TABLE_CACHE.move_to_end(key)
+    return table
+
+
+def evaluateRat(maze, rat_type):
+    """
+    Return the Outcome and number of steps of a run of the deterministic rat_type in maze
+    """
+    return compileRat(maze, rat_type).evaluate(maze)
+
+
+def testCompiler():
+    """
+    Check the compiled rats give the same results as Maze.run on some random mazes
+    """
+    import random
+    from Maze import CellType, makeRandomMaze
+
+    class ScalarWallFollower(Rat.WallFollower):
+        """ Overrides doTurn so compiled one state at a time with doTurn """
+        deterministic = True
+
+        def doTurn(self, loc_info):
+            super().doTurn(loc_info)
+
+    print("Testing compiler")
+    random.seed(1)
+    outcomes = set()
+    for imaze in range(40):
+        maze = makeRandomMaze(15, 1/3)
+        if maze is None:
+            continue
+
+        for rat_type in (Rat.DumbRat, Rat.TurnLeftRat, Rat.WallFollower, ScalarWallFollower):
+            maze.reset()
+            maze.addRat(rat_type())
+            expected = maze.runTrial(detect_cycles=False)
+            assert(evaluateRat(maze, rat_type) == expected)
+            assert(evaluateRat(maze, rat_type) == expected)     # From the cache
+            outcomes.add(expected[0])
+
+    assert(outcomes == set(Outcome))
+
+    class RandomWallFollower(Rat.WallFollower):
+        """ Inherits deterministic but turns at random """
+        def doTurn(self, loc_info):
+            if random.random() < 0.5:
+                super().doTurn(loc_info)
+
+    for rat_type in (Rat.RandomRat, RandomWallFollower):
+        try:
+            compileRat(maze, rat_type)
+            assert(False)
+        except ValueError:
+            pass
+
+    # Only the states of the cells reachable from the start are compiled:
+    table = compileRat(maze, Rat.WallFollower)
+    assert(np.count_nonzero(table.next_state >= 0) == maze.getNumReachableCells()*4)
+
+    # Editing a maze after compiling doesn't change the cached table for its old content:
+    def corridorMaze():
+        maze = Maze(10, 5)
+        maze.setCellType(1, 2, CellType.START)
+        maze.setCellType(8, 2, CellType.DESTINATION)
+        return maze
+    for rat_type in (Rat.DumbRat, ScalarWallFollower):
+        edited = corridorMaze()
+        expected = evaluateRat(edited, rat_type)
+        edited.setCellType(4, 2, CellType.DESTINATION)
+        assert(evaluateRat(edited, rat_type) != expected)
+        assert(evaluateRat(corridorMaze(), rat_type) == expected)
+    assert(expected == (Outcome.SUCCEEDED, 9))
+    assert(evaluateRat(corridorMaze(), Rat.DumbRat) == (Outcome.SUCCEEDED, 7))
+
+    print("All tests passed")
+
+
+if __name__ == '__main__':
+    testCompiler()
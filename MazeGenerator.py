@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:45:09 2026
+
+@author: que
+
+Procedural maze generation, for building corpora of mazes to benchmark the rats and the engine on.
+
+Each algorithm fills a boolean array with True for walls. The perfect maze algorithms (recursive
+backtracker, Kruskal and Prim) treat the cells with odd i and j as rooms and knock through the
+wall cells between them, so every room is reachable by exactly one path. Caves are grown with a
+cellular automaton and open rooms are a grid of rooms joined by doors, both of which have loops.
+
+The start and destination are always placed in cells joined by a path. The same seed gives the
+same maze. Kruskal, caves and rooms are vectorized and are the ones to use for the largest sizes;
+the backtracker and Prim walk the rooms one at a time in Python.
+
+"""
+
+import os
+import random
+import multiprocessing
+import numpy as np
+import scipy.ndimage
+import scipy.sparse
+from scipy.sparse.csgraph import minimum_spanning_tree
+
+from Maze import Maze, CellType
+
+
+ROOM_OFFSETS = ((0,1),(1,0),(0,-1),(-1,0))     # Neighbouring rooms
+CAVE_FILL = 0.45            # Fraction of cave cells which start as walls
+CAVE_ITERATIONS = 4         # Smoothing steps of the cave automaton
+ROOM_SIZE = 8               # Spacing of the walls between open rooms
+MAX_ATTEMPTS = 10           # Attempts at a cave with at least two connected cells
+
+
+def getNumRooms(width, height):
+    """
+    Return the number of rooms across and up for a perfect maze of the given size
+    """
+    num_rooms = ((width-1)//2, (height-1)//2)
+    if num_rooms[0] < 1 or num_rooms[1] < 1 or num_rooms[0]*num_rooms[1] < 2:
+        raise ValueError("A {0}x{1} maze is too small for two rooms".format(width, height))
+    return num_rooms
+
+
+def randomRooms(num_rooms, rng):
+    """
+    Return two different rooms chosen at random, as cell locations
+    """
+    first, second = rng.choice(num_rooms[0]*num_rooms[1], size=2, replace=False)
+    return [(2*int(room // num_rooms[1])+1, 2*int(room % num_rooms[1])+1) for room in (first, second)]
+
+
+def backtrackerWalls(width, height, rng):
+    """
+    Recursive backtracker (a depth first search with a stack), which makes long winding corridors
+    """
+    num_rooms = getNumRooms(width, height)
+    walls = np.ones((width, height), dtype=bool)
+    visited = np.zeros(num_rooms, dtype=bool)
+    py_random = random.Random(int(rng.integers(2**63)))
+
+    a, b = (int(x) for x in rng.integers(num_rooms))
+    visited[a,b] = True
+    walls[2*a+1,2*b+1] = False
+    stack = [(a,b)]
+    while stack:
+        a, b = stack[-1]
+        neighbours = [(a+da,b+db) for da,db in ROOM_OFFSETS
+                      if 0 <= a+da < num_rooms[0] and 0 <= b+db < num_rooms[1] and not visited[a+da,b+db]]
+        if not neighbours:
+            stack.pop()
+            continue
+        na, nb = neighbours[py_random.randrange(len(neighbours))]
+        visited[na,nb] = True
+        walls[a+na+1,b+nb+1] = False       # The wall cell between the two rooms
+        walls[2*na+1,2*nb+1] = False
+        stack.append((na,nb))
+
+    return walls, randomRooms(num_rooms, rng)
+
+
+def kruskalWalls(width, height, rng):
+    """
+    Kruskal's algorithm: the minimum spanning tree of the rooms with random weights on the walls
+    between them
+    """
+    num_rooms = getNumRooms(width, height)
+    rooms = np.arange(num_rooms[0]*num_rooms[1]).reshape(num_rooms)
+    first = np.concatenate([rooms[:-1,:].ravel(), rooms[:,:-1].ravel()])
+    second = np.concatenate([rooms[1:,:].ravel(), rooms[:,1:].ravel()])
+    weights = rng.random(first.size) + 1.0     # Zero weights would be missing from the graph
+
+    graph = scipy.sparse.coo_matrix((weights, (first, second)), shape=(rooms.size, rooms.size))
+    tree = minimum_spanning_tree(graph.tocsr()).tocoo()
+
+    walls = np.ones((width, height), dtype=bool)
+    walls[1:2*num_rooms[0]:2, 1:2*num_rooms[1]:2] = False
+    ai, bi = np.divmod(tree.row, num_rooms[1])
+    aj, bj = np.divmod(tree.col, num_rooms[1])
+    walls[ai+aj+1, bi+bj+1] = False
+    return walls, randomRooms(num_rooms, rng)
+
+
+def primWalls(width, height, rng):
+    """
+    Randomized Prim's algorithm: the maze grows from one room by adding a random room from its
+    frontier, which makes many short dead ends
+    """
+    num_rooms = getNumRooms(width, height)
+    walls = np.ones((width, height), dtype=bool)
+    in_maze = np.zeros(num_rooms, dtype=bool)
+    in_frontier = np.zeros(num_rooms, dtype=bool)
+    py_random = random.Random(int(rng.integers(2**63)))
+
+    def addRoom(a, b):
+        in_maze[a,b] = True
+        walls[2*a+1,2*b+1] = False
+        for da,db in ROOM_OFFSETS:
+            na, nb = a+da, b+db
+            if 0 <= na < num_rooms[0] and 0 <= nb < num_rooms[1] and not in_maze[na,nb] \
+                    and not in_frontier[na,nb]:
+                in_frontier[na,nb] = True
+                frontier.append((na,nb))
+
+    frontier = []
+    addRoom(*(int(x) for x in rng.integers(num_rooms)))
+    while frontier:
+        # Take a random room from the frontier, swapping the last one into its place
+        index = py_random.randrange(len(frontier))
+        frontier[index], frontier[-1] = frontier[-1], frontier[index]
+        a, b = frontier.pop()
+
+        # Join it to a random neighbour already in the maze
+        neighbours = [(a+da,b+db) for da,db in ROOM_OFFSETS
+                      if 0 <= a+da < num_rooms[0] and 0 <= b+db < num_rooms[1] and in_maze[a+da,b+db]]
+        na, nb = neighbours[py_random.randrange(len(neighbours))]
+        walls[a+na+1,b+nb+1] = False
+        addRoom(a, b)
+
+    return walls, randomRooms(num_rooms, rng)
+
+
+def randomOpenCells(open_cells, rng):
+    """
+    Return two different cells chosen at random where open_cells is True. Cells are drawn until
+    open ones are found, so this is quick whenever a fair fraction of the cells are open
+    """
+    chosen = []
+    while len(chosen) < 2:
+        for i, j in zip(*(rng.integers(n, size=64) for n in open_cells.shape)):
+            cell = (int(i), int(j))
+            if open_cells[cell] and cell not in chosen:
+                chosen.append(cell)
+                if len(chosen) == 2:
+                    break
+    return chosen
+
+
+def caveWalls(width, height, rng):
+    """
+    Caves grown by a cellular automaton from random noise: a cell becomes a wall when at least 5
+    of the 9 cells around and including it are walls. Only the largest cave is kept open, so the
+    start and destination are always connected. If no cave of two or more cells grows, as
+    happens in tiny mazes, the whole of the inside is left open
+    """
+    if (width-2)*(height-2) < 2:
+        raise ValueError("A {0}x{1} maze is too small for a cave".format(width, height))
+        
+    for attempt in range(MAX_ATTEMPTS):
+        walls = rng.random((width, height)) < CAVE_FILL
+        for iteration in range(CAVE_ITERATIONS):
+            walls[[0,-1],:] = True
+            walls[:,[0,-1]] = True
+            padded = np.pad(walls, 1, constant_values=True).astype(np.uint8)
+            count = sum(padded[1+di:width+1+di, 1+dj:height+1+dj]
+                        for di in (-1,0,1) for dj in (-1,0,1))
+            walls = count >= 5
+
+        # Rats move in four directions, so caves only touching at a corner aren't joined
+        labels, num_caves = scipy.ndimage.label(~walls)
+        if num_caves == 0:
+            continue
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0
+        largest = int(np.argmax(sizes))
+        if sizes[largest] < 2:
+            continue
+        cave = labels == largest
+        return ~cave, randomOpenCells(cave, rng)
+
+    walls = np.ones((width, height), dtype=bool)
+    walls[1:-1,1:-1] = False
+    return walls, randomOpenCells(~walls, rng)
+
+
+def roomWalls(width, height, rng, room_size=ROOM_SIZE):
+    """
+    Open rooms: a grid of walls every room_size cells with a door at a random place in each wall
+    between two rooms, so there are many routes between any two rooms
+    """
+    if width < 4 or height < 4:
+        raise ValueError("A {0}x{1} maze is too small for rooms".format(width, height))
+    walls = np.zeros((width, height), dtype=bool)
+    walls[[0,-1],:] = True
+    walls[:,[0,-1]] = True
+
+    # Wall lines, keeping at least one open cell between them and the borders
+    lines = [np.arange(room_size, size-2, room_size) for size in (width, height)]
+    walls[lines[0],:] = True
+    walls[:,lines[1]] = True
+
+    for axis in (0,1):
+        other = 1-axis
+        bounds = np.concatenate([[0], lines[other], [(width,height)[other]-1]])
+        first, last = bounds[:-1]+1, bounds[1:]-1     # The open cells between the wall lines
+        doors = first + (rng.random((lines[axis].size, first.size)) * (last-first+1)).astype(np.intp)
+        line_cells = np.broadcast_to(lines[axis][:,None], doors.shape)
+        if axis == 0:
+            walls[line_cells, doors] = False
+        else:
+            walls[doors, line_cells] = False
+
+    return walls, randomOpenCells(~walls, rng)
+
+
+ALGORITHMS = {
+    'backtracker': backtrackerWalls,
+    'kruskal': kruskalWalls,
+    'prim': primWalls,
+    'caves': caveWalls,
+    'rooms': roomWalls,
+}
+
+
+def generateMaze(width, height, algorithm='backtracker', seed=None):
+    """
+    Return a new Maze of the given size made by one of the ALGORITHMS, with a start and a
+    destination joined by a path. The same seed gives the same maze
+    """
+    rng = np.random.default_rng(seed)
+    walls, (start, destination) = ALGORITHMS[algorithm](width, height, rng)
+
+    maze = Maze(width, height)
+    maze.maze_array[walls] = CellType.WALL.value
+    maze.clearCaches()
+    maze.setCellType(start[0], start[1], CellType.START)
+    maze.setCellType(destination[0], destination[1], CellType.DESTINATION)
+    return maze
+
+
+def writeMaze(args):
+    """
+    Generate a maze and write it to a file, given a tuple of the file name and the arguments to
+    generateMaze. Returns the file name
+    """
+    filename, width, height, algorithm, seed = args
+    generateMaze(width, height, algorithm, seed).writeToFile(filename)
+    return filename
+
+
+def generateCorpus(directory, sizes, num_per_size=1, algorithms=None, seed=None, num_workers=1):
+    """
+    Write num_per_size mazes of each size in sizes, a list of (width,height) tuples, for each of
+    the algorithms (default all of them) to directory. The files are named
+    <algorithm>_<width>x<height>_<n>.npy and the list of file names is returned.
+
+    Each maze has its own seed spawned from seed, so the corpus is the same however many worker
+    processes write it.
+    """
+    if algorithms is None:
+        algorithms = sorted(ALGORITHMS)
+    os.makedirs(directory, exist_ok=True)
+
+    jobs = [(algorithm, width, height, n) for algorithm in algorithms for width,height in sizes
+            for n in range(num_per_size)]
+    seeds = [int(s.generate_state(1, np.uint64)[0])
+             for s in np.random.SeedSequence(seed).spawn(len(jobs))]
+    maze_args = [(os.path.join(directory, "{0}_{1}x{2}_{3}.npy".format(algorithm, width, height, n)),
+                  width, height, algorithm, maze_seed)
+                 for (algorithm, width, height, n), maze_seed in zip(jobs, seeds)]
+
+    if num_workers == 1:
+        return [writeMaze(args) for args in maze_args]
+    with multiprocessing.Pool(num_workers) as pool:
+        return pool.map(writeMaze, maze_args)
+
+
+def testGenerator():
+    """
+    Check every algorithm makes solvable mazes of several sizes, and that the perfect mazes
+    have exactly one path between any two cells
+    """
+    import tempfile
+    import shutil
+
+    print("Testing maze generator")
+    for algorithm in sorted(ALGORITHMS):
+        for width, height in ((5,4), (12,9), (31,31), (64,40)):
+            maze = generateMaze(width, height, algorithm, seed=width*height)
+            assert(maze.getWidth() == width and maze.getHeight() == height)
+            start = maze.getStart()
+            destination = maze.getDestination()
+            assert(start != destination)
+            assert(maze.getCellTypeByLocation(start) == CellType.START)
+
+            # The start and destination are joined:
+            labels = scipy.ndimage.label(maze.maze_array != CellType.WALL.value)[0]
+            assert(labels[start] == labels[destination])
+
+            open_cells = maze.maze_array != CellType.WALL.value
+            if algorithm in ('backtracker', 'kruskal', 'prim'):
+                # A tree: one fewer joins between open cells than there are open cells, all joined
+                num_joins = (open_cells[1:,:] & open_cells[:-1,:]).sum() + \
+                            (open_cells[:,1:] & open_cells[:,:-1]).sum()
+                assert(num_joins == open_cells.sum() - 1)
+                assert(labels.max() == 1)
+
+            again = generateMaze(width, height, algorithm, seed=width*height)
+            assert((again.maze_array == maze.maze_array).all())
+
+    directory = tempfile.mkdtemp()
+    try:
+        filenames = generateCorpus(directory, [(12,9),(21,15)], 2, ['kruskal','rooms'], seed=1)
+        assert(len(filenames) == 8)
+        maze = Maze(filename=filenames[-1])
+        assert(maze.hasStart() and maze.hasDestination())
+        again = generateCorpus(directory, [(12,9),(21,15)], 2, ['kruskal','rooms'], seed=1,
+                               num_workers=2)
+        assert(again == filenames)
+        assert((Maze(filename=again[-1]).maze_array == maze.maze_array).all())
+    finally:
+        shutil.rmtree(directory)
+
+    print("All tests passed")
+
+
+if __name__ == '__main__':
+    testGenerator()
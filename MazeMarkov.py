@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:22:47 2026
+
+@author: que
+
+Exact evaluation of a single rat in a Maze as an absorbing Markov chain.
+
+Instead of running trials, the chance of each turn the rat could make (RatBase.getTurnProbabilities)
+is used to build the chain of everything that decides what happens next: the rat's cell, its heading,
+where it was on the step before and its stuck count. Reaching the destination and getting stuck are
+absorbing. One sparse solve then gives the exact chance of each outcome and the expected number of
+steps.
+
+Without a horizon the rat has as long as it likes, and it only starves if it gets trapped going round
+without any chance of reaching the destination or getting stuck. With a horizon (Maze.run allows
+MAX_STEPS_MULTIPLIER times the number of cells) the solve also bounds the chance of a run lasting longer
+than the horizon. Only if that could be more than HORIZON_TOLERANCE is the chain stepped forward horizon
+times instead. That gives the exact results of Maze.run but costs a sparse product per step, about
+3*W*H of them, which grows roughly with the square of the maze area.
+
+"""
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+from scipy.sparse.csgraph import breadth_first_order
+
+from Maze import CellType, HEADING_OFFSETS, MAX_STEPS_STUCK, LocationInfo, MazeConfig
+from MazeBatch import START_HEADING, TURN_TABLE
+import Rat
+
+
+# Codes for where the rat was on the step before, relative to its cell. 0-3 are the neighbouring
+# cells for those heading codes
+NUM_LAST = 6
+LAST_SAME = 4           # In the same cell
+LAST_NONE = 5           # No step before - the rat has just been put at the start
+
+# Largest chance of a run outlasting the horizon which solveRat leaves out rather than stepping the
+# chain forward
+HORIZON_TOLERANCE = 1e-4
+NUM_MOMENTS = 8         # Moments of the number of steps used to bound the chance of long runs
+
+# Kinds of transition
+TRANSIENT = 0
+SUCCEEDED = 1
+STUCK = 2
+
+
+class MarkovResult(object):
+    """
+    The exact chance that a run succeeds, gets stuck or starves, and the expected number of steps of
+    the runs which succeed and get stuck (None if there is no chance of that outcome).
+    step_moments are E[T(T+1)...(T+k-1)] for k = 1, 2... where T is the number of steps before a
+    run ends, if they are known
+    """
+
+    def __init__(self, p_succeeded, p_stuck, mean_steps_succeeded, mean_steps_stuck, num_states,
+                 horizon=None, step_moments=None):
+        self.p_succeeded = p_succeeded
+        self.p_stuck = p_stuck
+        self.p_starved = max(0.0, 1.0 - p_succeeded - p_stuck)
+        self.mean_steps_succeeded = mean_steps_succeeded
+        self.mean_steps_stuck = mean_steps_stuck
+        self.num_states = num_states
+        self.horizon = horizon
+        self.step_moments = step_moments
+
+    def getLongRunBound(self, horizon):
+        """
+        Return an upper bound on the chance that a run lasts more than horizon steps. As
+        T(T+1)...(T+k-1) > horizon**k for those runs, Markov's inequality bounds it by each moment
+        over horizon**k
+        """
+        return min([1.0] + [moment / float(horizon)**k
+                            for k,moment in enumerate(self.step_moments, start=1)])
+
+
+class MarkovChain(object):
+    """
+    The transient states of a rat in a maze reachable from the start, the transitions between them
+    and the chance of absorption at the destination or by getting stuck from each of them.
+
+    A state is ((open cell*4 + heading)*NUM_LAST + last)*MAX_STEPS_STUCK + stuck count, where the
+    open cells are the cells which aren't walls, numbered in order.
+    """
+
+    def __init__(self, maze, rat_type):
+        self.maze = maze
+        self.rat_type = rat_type
+        height = maze.getHeight()
+
+        open_cells = np.flatnonzero(maze.maze_array.ravel() != CellType.WALL.value)
+        self.cells = open_cells
+        self.open_index = np.full(maze.maze_array.size, -1, dtype=np.int64)
+        self.open_index[open_cells] = np.arange(open_cells.size)
+        self.wall_mask = maze.getWallMask().ravel().astype(np.intp)
+        self.move_offsets = np.array([di*height + dj for di,dj in HEADING_OFFSETS], dtype=np.int64)
+
+        start = maze.getStart()
+        destination = maze.getDestination()
+        self.dest_cell = destination[0]*height + destination[1]
+        self.turn_probabilities = self.getTurnProbabilities()
+
+        start_state = self.encode(self.open_index[start[0]*height + start[1]], START_HEADING,
+                                  LAST_NONE, 0)
+        self.buildChain(start_state)
+
+    def encode(self, open_cell, heading, last, num_same):
+        return ((open_cell*4 + heading)*NUM_LAST + last)*MAX_STEPS_STUCK + num_same
+
+    def getTurnProbabilities(self):
+        """
+        Return an array (open cell, heading, turn code) of the chance of each turn the rat makes
+        """
+        maze = self.maze
+        height = maze.getHeight()
+        rat = self.rat_type()
+        probabilities = np.zeros((self.cells.size, 4, 4))
+        for open_cell,cell in enumerate(self.cells.tolist()):
+            location = divmod(cell, height)
+            rat.location = location
+            for heading in range(4):
+                rat.setHeading(heading)
+                loc_info = LocationInfo(maze, location, heading*90)
+                for probability,turn in rat.getTurnProbabilities(loc_info):
+                    probabilities[open_cell,heading,turn] += probability
+        return probabilities
+
+    def getTransitions(self, states):
+        """
+        Return arrays of the source state, destination state (-1 if absorbed), probability and kind
+        of every transition out of states
+        """
+        num_same = states % MAX_STEPS_STUCK
+        last = (states // MAX_STEPS_STUCK) % NUM_LAST
+        heading = (states // (MAX_STEPS_STUCK*NUM_LAST)) % 4
+        open_cell = states // (MAX_STEPS_STUCK*NUM_LAST*4)
+
+        # One transition for each possible turn:
+        probability = self.turn_probabilities[open_cell, heading].ravel()
+        sources = np.repeat(states, 4)
+        num_same = np.repeat(num_same, 4)
+        last = np.repeat(last, 4)
+        cell = np.repeat(self.cells[open_cell], 4)
+        new_heading = TURN_TABLE[np.tile(np.arange(4), states.size), np.repeat(heading, 4)]
+
+        possible = probability > 0
+        probability = probability[possible]
+        sources = sources[possible]
+        num_same = num_same[possible]
+        last = last[possible]
+        cell = cell[possible]
+        new_heading = new_heading[possible]
+
+        moving = ((self.wall_mask[cell] >> new_heading) & 1) == 0
+        new_cell = np.where(moving, cell + self.move_offsets[new_heading], cell)
+
+        # Back where the rat was two steps ago?
+        same = np.where(moving, last == new_heading, last == LAST_SAME)
+        new_num_same = np.where(same, num_same+1, 0)
+        new_last = np.where(moving, (new_heading+2) % 4, LAST_SAME)
+
+        kind = np.full(sources.size, TRANSIENT, dtype=np.int8)
+        kind[new_cell == self.dest_cell] = SUCCEEDED
+        kind[new_num_same >= MAX_STEPS_STUCK] = STUCK
+
+        destinations = np.full(sources.size, -1, dtype=np.int64)
+        transient = kind == TRANSIENT
+        destinations[transient] = self.encode(self.open_index[new_cell[transient]],
+                                              new_heading[transient], new_last[transient],
+                                              new_num_same[transient])
+        return sources, destinations, probability, kind
+
+    def buildChain(self, start_state):
+        """
+        Find all of the states reachable from start_state a layer at a time, and build the sparse
+        transition matrix between them
+        """
+        visited = np.zeros(self.cells.size*4*NUM_LAST*MAX_STEPS_STUCK, dtype=bool)
+        visited[start_state] = True
+        frontier = np.array([start_state], dtype=np.int64)
+        all_transitions = []
+        while frontier.size:
+            transitions = self.getTransitions(frontier)
+            all_transitions.append(transitions)
+            destinations = transitions[1]
+            new_states = np.unique(destinations[destinations >= 0])
+            new_states = new_states[~visited[new_states]]
+            visited[new_states] = True
+            frontier = new_states
+
+        self.states = np.flatnonzero(visited)
+        sources, destinations, probability, kind = [np.concatenate(t) for t in zip(*all_transitions)]
+        rows = np.searchsorted(self.states, sources)
+        num_states = self.states.size
+
+        transient = kind == TRANSIENT
+        columns = np.searchsorted(self.states, destinations[transient])
+        self.transitions = scipy.sparse.csr_matrix((probability[transient], (rows[transient], columns)),
+                                                   shape=(num_states, num_states))
+        self.p_succeed = np.bincount(rows[kind == SUCCEEDED], probability[kind == SUCCEEDED],
+                                     minlength=num_states)
+        self.p_stuck = np.bincount(rows[kind == STUCK], probability[kind == STUCK],
+                                   minlength=num_states)
+        self.start = int(np.searchsorted(self.states, start_state))
+
+    def getNumStates(self):
+        return self.states.size
+
+    def solve(self):
+        """
+        Solve the chain with no limit on the number of steps and return a MarkovResult.
+
+        If a is the chance of succeeding from each state then (I-Q)a = p_succeed, and if g is the
+        expected number of steps of the successful runs times a then (I-Q)g = a. States which can't
+        reach the destination or get stuck are left out; a rat which reaches them starves.
+
+        The moments E[T(T+1)...(T+k-1)] of the number of steps T until a run ends are k! times
+        ((I-Q)^-k 1) at the start, one more solve each, and bound how many runs a horizon would cut
+        short.
+        """
+        num_states = self.getNumStates()
+
+        # States which can be absorbed - found from a virtual node linked to every state with a
+        # chance of absorption, following the transitions backwards
+        absorbing = np.flatnonzero((self.p_succeed + self.p_stuck) > 0)
+        reverse = self.transitions.T.tocoo()
+        graph = scipy.sparse.csr_matrix(
+            (np.ones(reverse.nnz + absorbing.size),
+             (np.concatenate([reverse.row, np.full(absorbing.size, num_states)]),
+              np.concatenate([reverse.col, absorbing]))),
+            shape=(num_states+1, num_states+1))
+        solvable = breadth_first_order(graph, num_states, directed=True, return_predecessors=False)
+        solvable = np.sort(solvable[solvable < num_states])
+
+        position = np.searchsorted(solvable, self.start)
+        if position >= solvable.size or solvable[position] != self.start:
+            return MarkovResult(0.0, 0.0, None, None, num_states, step_moments=[0.0])
+
+        q = self.transitions[solvable][:,solvable]
+        lu = scipy.sparse.linalg.splu(scipy.sparse.identity(solvable.size, format='csc') - q.tocsc())
+        results = []
+        for p_absorb in (self.p_succeed[solvable], self.p_stuck[solvable]):
+            a = lu.solve(p_absorb)
+            g = lu.solve(a)
+            probability = float(a[position])
+            results.append((probability, float(g[position])/probability if probability > 0 else None))
+        step_moments = []
+        moments = np.ones(solvable.size)
+        for k in range(1, NUM_MOMENTS+1):
+            moments = k * lu.solve(moments)
+            step_moments.append(float(moments[position]))
+
+        return MarkovResult(results[0][0], results[1][0], results[0][1], results[1][1], num_states,
+                            step_moments=step_moments)
+
+    def solveWithHorizon(self, horizon):
+        """
+        Step the chance of being in each state forward horizon times and return a MarkovResult for
+        runs which end after at most horizon steps, as in Maze.run
+        """
+        distribution = np.zeros(self.getNumStates())
+        distribution[self.start] = 1.0
+        forward = self.transitions.T.tocsr()
+        totals = [0.0, 0.0]
+        step_totals = [0.0, 0.0]
+        for step in range(1, horizon+1):
+            for ioutcome,p_absorb in enumerate((self.p_succeed, self.p_stuck)):
+                absorbed = float(distribution @ p_absorb)
+                totals[ioutcome] += absorbed
+                step_totals[ioutcome] += step*absorbed
+            distribution = forward @ distribution
+
+        means = [step_totals[i]/totals[i] if totals[i] > 0 else None for i in range(2)]
+        return MarkovResult(totals[0], totals[1], means[0], means[1], self.getNumStates(), horizon)
+
+
+def solveRat(maze, rat_type, horizon=None, tolerance=HORIZON_TOLERANCE):
+    """
+    Return the exact MarkovResult for a single rat of rat_type in maze. With a horizon the run is
+    limited to that many steps; use maze.getMaxSteps() for the limit Maze.run uses.
+
+    The chain is always solved with no limit first, which is a single sparse factorisation. If the
+    chance of a run lasting longer than the horizon could be more than tolerance the chain is then
+    stepped forward horizon times with solveWithHorizon, which is far slower for large mazes.
+    Otherwise the unlimited result is returned, which is within tolerance of the limited one
+    """
+    if not maze.hasStart() or not maze.hasDestination():
+        raise MazeConfig("The maze needs a start and destination to be solved")
+    chain = MarkovChain(maze, rat_type)
+    result = chain.solve()
+    if horizon is None or result.getLongRunBound(horizon) <= tolerance:
+        return result
+    return chain.solveWithHorizon(horizon)
+
+
+def testMarkov():
+    """
+    Check the exact results against the batch simulator and a deterministic rat
+    """
+    from Maze import Maze, Outcome
+    import MazeCompiler
+    import MazeBatch
+
+    print("Testing Markov solver")
+    maze = Maze(9,8)
+    for j in range(1,5):
+        maze.setCellType(4, j, CellType.WALL)
+    maze.setCellType(1, 1, CellType.START)
+    maze.setCellType(7, 2, CellType.DESTINATION)
+
+    # A deterministic rat has a single path through the chain:
+    for rat_type in (Rat.DumbRat, Rat.TurnLeftRat, Rat.WallFollower):
+        outcome, num_steps = MazeCompiler.evaluateRat(maze, rat_type)
+        result = solveRat(maze, rat_type, maze.getMaxSteps())
+        if outcome == Outcome.SUCCEEDED:
+            assert(abs(result.p_succeeded - 1.0) < 1e-9 and result.mean_steps_succeeded == num_steps)
+        elif outcome == Outcome.STUCK:
+            assert(abs(result.p_stuck - 1.0) < 1e-9 and result.mean_steps_stuck == num_steps)
+        else:
+            assert(abs(result.p_starved - 1.0) < 1e-9)
+
+    num_trials = 8000
+    for rat_type in (Rat.RandomRat, Rat.SmellingRat, Rat.SmellingRat2):
+        result = solveRat(maze, rat_type, maze.getMaxSteps())
+        assert(abs(result.p_succeeded + result.p_stuck + result.p_starved - 1.0) < 1e-9)
+
+        batch = MazeBatch.BatchSimulator(maze, rat_type, seed=1).run(num_trials)
+        p_succeeded = batch.getNumOutcome(Outcome.SUCCEEDED)/num_trials
+        p_stuck = batch.getNumOutcome(Outcome.STUCK)/num_trials
+        assert(abs(p_succeeded - result.p_succeeded) < 0.03)
+        assert(abs(p_stuck - result.p_stuck) < 0.03)
+        if result.p_succeeded > 0.1:
+            mean_steps = batch.getSuccessfulSteps().mean()
+            assert(abs(mean_steps - result.mean_steps_succeeded) < 0.05*result.mean_steps_succeeded)
+
+        # With no limit on the steps the rat can only do better or get stuck more:
+        unlimited = solveRat(maze, rat_type)
+        assert(unlimited.p_succeeded >= result.p_succeeded - 1e-9)
+        assert(unlimited.p_stuck >= result.p_stuck - 1e-9)
+
+        # Stepping the chain forward only changes the results as much as the bound allows:
+        limited = solveRat(maze, rat_type, maze.getMaxSteps(), tolerance=0.0)
+        bound = unlimited.getLongRunBound(maze.getMaxSteps())
+        assert(limited.horizon == maze.getMaxSteps())
+        assert(unlimited.p_succeeded - limited.p_succeeded <= bound + 1e-9)
+        assert(unlimited.p_stuck - limited.p_stuck <= bound + 1e-9)
+
+        # A short horizon starves many runs, so the chain is stepped forward:
+        short = solveRat(maze, rat_type, 10)
+        assert(short.horizon == 10 and short.p_starved > unlimited.p_starved)
+
+    print("All tests passed")
+
+
+if __name__ == '__main__':
+    testMarkov()
@@ -11,7 +11,7 @@ Player for recorded Maze simulations
 from tkinter import *
 from tkinter import messagebox, filedialog
 import os.path
-from Maze import CellType, Maze
+from Maze import CellType, Maze, MazeConfig
 from MazeView import MazeView
 
 import Rat
@@ -45,11 +45,28 @@ class MazePlayer(object):
         self.speed_scale = Scale(self.speed_frame, from_=1, to=10, orient=HORIZONTAL)
         self.speed_scale.set(8)
         self.speed_scale.pack(side=LEFT)
+        Label(self.speed_frame,text="Steps per frame:").pack(side=LEFT)
+        self.skip_scale = Scale(self.speed_frame, from_=1, to=100, orient=HORIZONTAL)
+        self.skip_scale.pack(side=LEFT)
         self.speed_frame.pack(anchor=W)
         
+        # Scrubbing and jumping to a step:
+        self.step_frame = Frame(self.master)
+        self.step_scale = Scale(self.step_frame, from_=0, to=0, orient=HORIZONTAL, length=300,
+                                showvalue=0, command=self.scrub)
+        self.step_scale.pack(side=LEFT)
+        Label(self.step_frame,text="Step:").pack(side=LEFT)
+        self.step_entry = Entry(self.step_frame, width=8)
+        self.step_entry.pack(side=LEFT)
+        self.step_entry.bind("<Return>", lambda event: self.jumpToStep())
+        Button(self.step_frame, text="Go", command=self.jumpToStep).pack(side=LEFT)
+        self.step_frame.pack(anchor=W)
         
         self.maze = None
         self.maze_view = None
+        self.trace = None
+        self.step = 0
+        self.playing = False
         
        
         mainloop()
@@ -73,6 +90,32 @@ class MazePlayer(object):
         self.maze_view.drawMaze()  
          
         self.maze_file_name = maze_file
+        self.openSteps()
+        
+    def openSteps( self ):
+        """
+        Open the step file of the current maze file, ready to be played from the start
+        """
+        self.stop()
+        if self.trace:
+            self.trace.close()
+            self.trace = None
+        self.play_button.config(state=DISABLED)
+        
+        step_file_name = os.path.splitext(self.maze_file_name)[0] + '.stp'
+        try:
+            self.trace = self.maze.openSavedSteps(step_file_name)
+        except FileNotFoundError:
+            messagebox.showerror('No step file',"There is no step file associated with maze\n{0}".format
+                                 (self.maze_file_name))
+            return
+        except MazeConfig as e:
+            messagebox.showerror('Wrong step file', str(e))
+            return
+            
+        self.step = 0
+        self.step_scale.config(to=self.trace.num_steps)
+        self.step_scale.set(0)
         self.play_button.config(state=NORMAL)
        
     def getSpeed(self):
@@ -85,14 +128,61 @@ class MazePlayer(object):
     
     def play( self ):
         """
-        Play the saved steps of the current maze file
+        Play or pause the saved steps of the current maze file
         """
-        step_file_name = os.path.splitext(self.maze_file_name)[0] + '.stp'
+        if self.playing:
+            self.stop()
+            return
+        if self.step >= self.trace.num_steps:
+            self.showStep(0)
+        self.playing = True
+        self.play_button.config(text="Pause")
+        self.nextFrame()
+        
+    def stop( self ):
+        self.playing = False
+        self.play_button.config(text="Play")
+        
+    def nextFrame( self ):
+        """
+        Show the next frame and schedule the one after. With more than one step per frame the
+        steps in between are skipped rather than drawn
+        """
+        if not self.playing:
+            return
+        self.showStep(min(self.step + self.skip_scale.get(), self.trace.num_steps))
+        if self.step >= self.trace.num_steps:
+            self.stop()
+        else:
+            self.master.after(int(self.getSpeed()*2000), self.nextFrame)
+            
+    def showStep( self, step ):
+        """
+        Show the rats where they were after the given step
+        """
+        self.step = step
+        self.maze.showSavedStep(self.trace, step)
+        self.step_scale.set(step)
+        
+    def scrub( self, value ):
+        """
+        When the step scale is dragged
+        """
+        if self.trace and int(value) != self.step:
+            self.showStep(int(value))
+    
+    def jumpToStep( self ):
+        """
+        When a step number is entered
+        """
+        if not self.trace:
+            return
         try:
-            self.maze.playSavedSteps(step_file_name, self.getSpeed())
-        except FileNotFoundError:
-            messagebox.showerror('No step file',"There is no step file associated with maze\n{0}".format
-                                 (self.maze_file_name))
+            step = int(self.step_entry.get())
+        except ValueError:
+            messagebox.showerror('Bad step',"The step must be a whole number")
+            return
+        self.showStep(max(0, min(step, self.trace.num_steps)))
 
 
 
@@ -12,16 +12,367 @@ Useful for testing Rats which have a stochastic component to their movement
 """
 
 import Maze
-from Maze import Maze,RatStuck, RatStarved
+from Maze import Maze,RatStuck, RatStarved, Outcome
 import Rat
+import MazeBatch
+import MazeCompiler
+import MazeMarkov
 import numpy as np
 import pylab
+import os
+import random
+import sys
+import multiprocessing
+import cProfile
+import pstats
 
 
-def run_maze_trials( num_trials, maze_file_name, rat_type, num_rats=1 ):
+MAX_HISTOGRAM_BINS = 4096    # Most bins kept by StepStatistics, whatever the number of trials
+CHUNKS_PER_WORKER = 4        # Trials are split into this many chunks per worker process
+
+
+class StepStatistics(object):
+    """
+    Statistics of the number of steps of successful trials, kept in constant memory however many
+    trials are added: the count, minimum and how often it occurs, maximum, mean and variance
+    (Welford's method), the sum of 1/steps for the mean efficiency and a histogram with fixed bins
+    covering 0 to max_steps.
+    
+    While the number of steps fits in MAX_HISTOGRAM_BINS each bin is a single number of steps and
+    the median is exact, otherwise it is estimated from the histogram.
+    """
+    
+    def __init__(self, max_steps, num_bins=MAX_HISTOGRAM_BINS):
+        self.count = 0
+        self.min_steps = None
+        self.num_with_min = 0
+        self.max_steps = None
+        self.mean = 0.0
+        self.sum_squares = 0.0      # Sum of squared differences from the mean
+        self.sum_reciprocal = 0.0   # Sum of 1/steps
+        self.bin_width = max(1, -(-(max_steps+1) // num_bins))
+        self.histogram = np.zeros((max_steps+1 + self.bin_width-1) // self.bin_width, dtype=np.int64)
+        
+    def add(self, num_steps):
+        """
+        Add the number of steps of one successful trial
+        """
+        self.count += 1
+        if self.min_steps == None or num_steps < self.min_steps:
+            self.min_steps = num_steps
+            self.num_with_min = 1
+        elif num_steps == self.min_steps:
+            self.num_with_min += 1
+        if self.max_steps == None or num_steps > self.max_steps:
+            self.max_steps = num_steps
+            
+        delta = num_steps - self.mean
+        self.mean += delta / self.count
+        self.sum_squares += delta * (num_steps - self.mean)
+        self.sum_reciprocal += 1.0 / max(1, num_steps)
+        self.histogram[num_steps // self.bin_width] += 1
+        
+    def addMany(self, steps):
+        """
+        Add an array of the numbers of steps of successful trials
+        """
+        steps = np.asarray(steps, dtype=np.int64)
+        if steps.size == 0:
+            return
+        other = StepStatistics(0)
+        other.bin_width = self.bin_width
+        other.count = int(steps.size)
+        other.min_steps = int(steps.min())
+        other.num_with_min = int(np.count_nonzero(steps == other.min_steps))
+        other.max_steps = int(steps.max())
+        other.mean = float(steps.mean())
+        other.sum_squares = float(((steps - other.mean)**2).sum())
+        other.sum_reciprocal = float((1.0 / np.maximum(steps, 1)).sum())
+        other.histogram = np.bincount(steps // self.bin_width, minlength=self.histogram.size)
+        self.merge(other)
+        
+    def merge(self, other):
+        """
+        Add the statistics of other, which must have the same bins
+        """
+        if other.count == 0:
+            return
+        if self.count == 0 or other.min_steps < self.min_steps:
+            self.min_steps = other.min_steps
+            self.num_with_min = other.num_with_min
+        elif other.min_steps == self.min_steps:
+            self.num_with_min += other.num_with_min
+        if self.count == 0 or other.max_steps > self.max_steps:
+            self.max_steps = other.max_steps
+            
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.sum_squares += other.sum_squares + delta*delta * self.count * other.count / count
+        self.sum_reciprocal += other.sum_reciprocal
+        self.count = count
+        self.histogram += other.histogram
+        
+    def getVariance(self):
+        return self.sum_squares / self.count if self.count else 0.0
+    
+    def getStdDev(self):
+        return self.getVariance() ** 0.5
+    
+    def getMeanEfficiency(self, shortest_path_length):
+        """
+        Return the mean over the trials of shortest_path_length/steps, 1.0 for a rat which always
+        takes the shortest path
+        """
+        return shortest_path_length * self.sum_reciprocal / self.count if self.count else 0.0
+    
+    def getMedian(self):
+        """
+        Return the median number of steps, interpolated within its histogram bin if the bins are
+        wider than one step
+        """
+        if self.count == 0:
+            return None
+        cumulative = np.cumsum(self.histogram)
+        ibin = int(np.searchsorted(cumulative, self.count/2))
+        if self.bin_width == 1:
+            if self.count % 2 == 0 and cumulative[ibin] == self.count//2:
+                # Even count split between two bins
+                next_bin = ibin + 1 + int(np.flatnonzero(self.histogram[ibin+1:])[0])
+                return (ibin + next_bin) / 2
+            return float(ibin)
+        before = cumulative[ibin] - self.histogram[ibin]
+        fraction = (self.count/2 - before) / self.histogram[ibin]
+        return (ibin + fraction) * self.bin_width
+    
+    def getHistogram(self, num_bins=50):
+        """
+        Return the bin edges and counts of a histogram of at most num_bins bins covering the
+        minimum to the maximum number of steps, for plotting
+        """
+        first = self.min_steps // self.bin_width
+        last = self.max_steps // self.bin_width + 1
+        group = max(1, -(-(last-first) // num_bins))
+        counts = np.add.reduceat(self.histogram[first:last], np.arange(0, last-first, group))
+        edges = (first + np.arange(counts.size+1)*group) * self.bin_width
+        return edges, counts
+        
+        
+class TrialResults(object):
+    """
+    How the trials of a campaign (or part of one) ended: the number that succeeded, got stuck or
+    starved, StepStatistics of the successful trials and how to run the best trial, the first one
+    found with the fewest steps, again. Serial trials are replayed from their own seed; a trial run
+    by the batch simulator is replayed by running its batch of batch_trials trials again.
+    """
+    
+    def __init__(self, max_steps):
+        self.num_succeeded = 0
+        self.num_stuck = 0
+        self.num_starved = 0
+        self.step_stats = StepStatistics(max_steps)
+        self.min_steps = None
+        self.best_seed = None
+        self.best_trial = None
+        self.batch_trials = None
+        
+    def getNumTrials(self):
+        return self.num_succeeded + self.num_stuck + self.num_starved
+        
+    def addSuccess(self, num_steps, seed, trial=None, batch_trials=None):
+        """
+        Add a successful trial which took num_steps and was run with seed. For the batch simulator
+        trial is its index in a batch of batch_trials trials
+        """
+        self.num_succeeded += 1
+        self.step_stats.add(num_steps)
+        self.setBest(num_steps, seed, trial, batch_trials)
+        
+    def setBest(self, num_steps, seed, trial=None, batch_trials=None):
+        """
+        Make the given trial the best if it took fewer steps than the best so far
+        """
+        if self.min_steps == None or num_steps < self.min_steps:
+            self.min_steps = num_steps
+            self.best_seed = seed
+            self.best_trial = trial
+            self.batch_trials = batch_trials
+            
+    def merge(self, other):
+        """
+        Add the results of other, which ran after the trials in these results
+        """
+        self.num_succeeded += other.num_succeeded
+        self.num_stuck += other.num_stuck
+        self.num_starved += other.num_starved
+        self.step_stats.merge(other.step_stats)
+        if other.min_steps != None:
+            self.setBest(other.min_steps, other.best_seed, other.best_trial, other.batch_trials)
+            
+            
+def new_seed():
+    """
+    Return a fresh 64 bit seed from the operating system
+    """
+    return int(np.random.SeedSequence().generate_state(1, np.uint64)[0])
+    
+    
+def starved_results( num_trials, maze ):
+    """
+    Return the TrialResults of "num_trials" trials in a maze whose destination can't be reached
+    from the start, without running them: no rat can succeed, so all of them are counted as
+    starved
+    """
+    results = TrialResults(maze.getMaxSteps())
+    results.num_starved = num_trials
+    return results
+    
+    
+def run_batch_trials( num_trials, maze, rat_type, seed=None, num_rats=1 ):
+    """
+    Run "num_trials" trials of "num_rats" rats of "rat_type" in "maze" with the lockstep batch
+    simulator and return the TrialResults
+    
+    The maze isn't checked for a path from the start to the destination, as that would flood
+    fill it again for every chunk. Callers check it once with maze.isSolvable() and use
+    starved_results if there isn't one, as run_maze_trials does
+    """
+    if seed is None:
+        seed = new_seed()
+    results = TrialResults(maze.getMaxSteps())
+    batch_result = MazeBatch.BatchSimulator(maze, rat_type, seed, num_rats).run(num_trials)
+    
+    results.num_succeeded = batch_result.getNumOutcome(Outcome.SUCCEEDED)
+    results.num_stuck = batch_result.getNumOutcome(Outcome.STUCK)
+    results.num_starved = batch_result.getNumOutcome(Outcome.STARVED)
+    results.step_stats.addMany(batch_result.getSuccessfulSteps())
+    
+    best_trial = batch_result.getBestTrial()
+    if best_trial is not None:
+        results.setBest(int(batch_result.num_steps[best_trial]), seed, best_trial, num_trials)
+        
+    return results
+    
+
+def run_trial_chunk( num_trials, maze_file_name, rat_type, num_rats=1, batch=False, seed=None,
+                    progress=None ):
+    """
+    Run "num_trials" trials with "num_rats" rats of "rat_type" in the maze given by "maze_file_name"
+    and return the TrialResults. Trial n has its random numbers seeded with "seed" + n, so any
+    trial can be run again with run_trial_again.
+    
+    If "progress" is given it is called with the TrialResults so far after every 2% of the trials.
+    
+    This is the work done by each process when the trials are run in parallel. As with
+    run_batch_trials the caller checks the maze is solvable, once, before running the chunks.
+    """
+    if seed is None:
+        seed = new_seed()
+    if batch:
+        maze = Maze(filename=maze_file_name, mmap_mode='r')
+        return run_batch_trials(num_trials, maze, rat_type, seed, num_rats)
+    
+    # Read the maze once, memory-mapped so that worker processes share it, and reset it for each
+    # trial. Steps aren't recorded; the best trial is run again at the end to record them
+    maze = Maze(filename=maze_file_name, mmap_mode='r')
+    maze.setHeadless()
+    maze.setRecordSteps(False)
+    results = TrialResults(maze.getMaxSteps())
+    for trial in range(num_trials):
+        
+        if progress and trial and trial % max(1,num_trials//50) == 0:
+            progress(results)
+        random.seed(seed + trial)
+        maze.reset()
+        for irat in range(num_rats):
+            rat = rat_type()
+            maze.addRat(rat)
+        
+        outcome, num_steps = maze.runTrial()
+        if outcome == Outcome.SUCCEEDED:
+            results.addSuccess(num_steps, seed + trial)
+        elif outcome == Outcome.STUCK:
+            results.num_stuck += 1
+        else:
+            results.num_starved += 1
+            
+    return results
+    
+
+def run_trial_chunk_args( args ):
+    """
+    Run a chunk of trials given a tuple of the arguments to run_trial_chunk, for Pool.imap
+    """
+    return run_trial_chunk(*args)
+    
+    
+def run_trial_again( maze, rat_type, num_rats, results, step_filename ):
+    """
+    Run the best trial in "results" again in "maze", saving its steps to "step_filename", and
+    return its number of steps
+    """
+    maze.reset()
+    if results.batch_trials is not None:
+        simulator = MazeBatch.BatchSimulator(maze, rat_type, results.best_seed, num_rats)
+        maze.steps = simulator.run(results.batch_trials, record_trial=results.best_trial).steps
+        maze.saveSteps(step_filename)
+        return len(maze.steps)
+    
+    # The steps are written to the trace file as the trial runs:
+    random.seed(results.best_seed)
+    maze.setHeadless()
+    maze.setRecordSteps(False)
+    for irat in range(num_rats):
+        maze.addRat(rat_type())
+    maze.recordTrace(step_filename)
+    try:
+        return maze.run()
+    except (RatStuck, RatStarved):
+        return None
+    
+
+def solve_maze( maze_file_name, rat_type, limit_steps=True ):
+    """
+    Evaluate a single rat of "rat_type" in the maze given by "maze_file_name" exactly, as an
+    absorbing Markov chain, rather than by running trials. Prints the chance that the run succeeds,
+    gets stuck or starves and the expected number of steps, and returns the MazeMarkov.MarkovResult
+    
+    If "limit_steps" is True the rat starves after the same number of steps as in Maze.run. The
+    chain is solved with no limit first, a single sparse factorisation, and only stepped forward
+    once per step (about 3*W*H sparse products) when runs could last longer than the limit with a
+    chance of more than MazeMarkov.HORIZON_TOLERANCE.
+    """
+    maze = Maze(filename=maze_file_name)
+    horizon = maze.getMaxSteps() if limit_steps else None
+    result = MazeMarkov.solveRat(maze, rat_type, horizon)
+    
+    print("")
+    print("Solved maze in {0} for rat {1} ({2} states)".format(maze_file_name, rat_type.__name__,
+          result.num_states))
+    print("")
+    print("  The rat succeeds with probability {0:.4%}".format(result.p_succeeded))
+    print("  The rat gets stuck with probability {0:.4%}".format(result.p_stuck))
+    print("  The rat starves with probability {0:.4%}".format(result.p_starved))
+    if result.mean_steps_succeeded is not None:
+        print("  Expected number of steps to succeed: {0:.1f}".format(result.mean_steps_succeeded))
+    return result
+    
+
+def run_maze_trials( num_trials, maze_file_name, rat_type, num_rats=1, batch=False, num_workers=1,
+                    seed=None, analytic=False ):
     """
     Run "num_rats" rats of "rat_type" in the maze given by "maze_file_name" for "num_trials" times
     
+    If "batch" is True then all of the trials are run together with the lockstep batch simulator
+    in MazeBatch, which is much faster for large numbers of trials or rats
+    
+    If "num_workers" is more than one the trials are split between that many processes. Each process
+    gets its own random number stream, all derived from "seed", so a campaign with the same seed
+    and number of workers can be repeated
+    
+    If "analytic" is True and there is a single rat then no trials are run. The exact chances of
+    each outcome and the expected number of steps are found with solve_maze instead
+    
     Print the following statistics:
         Number of times (and percentage) of times the run succeeded
         Min, Max, Mean and Std Dev of number of steps
@@ -34,11 +385,9 @@ def run_maze_trials( num_trials, maze_file_name, rat_type, num_rats=1 ):
     
     """
     
-    trial_steps = []
-    num_succeeded = 0
-    num_stuck = 0
-    num_starved = 0
-    min_steps = None
+    if analytic and num_rats == 1:
+        solve_maze(maze_file_name, rat_type)
+        return
     
     print("")
     if num_rats == 1:
@@ -49,50 +398,75 @@ def run_maze_trials( num_trials, maze_file_name, rat_type, num_rats=1 ):
    
     print("")
         
+    step_filename = os.path.splitext(maze_file_name)[0] + '.stp'
+    maze = Maze(filename=maze_file_name, mmap_mode='r')
+    
+    # With several workers there are more chunks than workers, so the results can be merged in
+    # order as they come in
+    num_chunks = 1 if num_workers == 1 else max(1, min(num_trials, num_workers*CHUNKS_PER_WORKER))
+    seeds = [int(s.generate_state(1, np.uint64)[0])
+             for s in np.random.SeedSequence(seed).spawn(num_chunks)]
+    
+    if not maze.isSolvable():
+        print("The destination can't be reached from the start, so every trial starves")
+        results = starved_results(num_trials, maze)
+    elif num_workers == 1:
+        results = run_trial_chunk(num_trials, maze_file_name, rat_type, num_rats, batch, seeds[0],
+                                  progress=lambda results: print("#",end='',flush=True))
+    else:
+        chunk_args = [(num_trials//num_chunks + (chunk < num_trials % num_chunks), maze_file_name,
+                       rat_type, num_rats, batch, seeds[chunk]) for chunk in range(num_chunks)]
         
-    for trial in range(num_trials):
+        results = TrialResults(maze.getMaxSteps())
+        with multiprocessing.Pool(num_workers) as pool:
+            for chunk in pool.imap(run_trial_chunk_args, chunk_args):
+                results.merge(chunk)
+                print("# {0} trials, mean steps {1:.1f}".format(results.getNumTrials(),
+                      results.step_stats.mean))
+            
+    if results.min_steps is not None:
+        # Only the seed of the best trial was kept, so run it again to record and save its steps
+        num_steps = run_trial_again(maze, rat_type, num_rats, results, step_filename)
+        if num_steps != results.min_steps:
+            print("Warning: the best trial took {0} steps when run again rather than {1} - does the rat"
+                  " use random numbers other than from the random module?".format(num_steps,
+                  results.min_steps))
         
-        if trial and trial % (num_trials//50) == 0:
-            print("#",end='')
-        maze = Maze(filename=maze_file_name)
-        for irat in range(num_rats):
-            rat = rat_type()
-            maze.addRat(rat)
-        
-        try:
-            num_steps = maze.run()
-            num_succeeded += 1
-            trial_steps.append(num_steps)
-            if min_steps == None or num_steps < min_steps:
-                step_filename = os.path.splitext(maze_file_name)[0] + '.stp'
-                maze.saveSteps(step_filename)
-                min_steps = num_steps
-        except RatStuck:
-            num_stuck += 1
-        except RatStarved:
-            num_starved += 1
+    num_succeeded = results.num_succeeded
+    num_stuck = results.num_stuck
+    num_starved = results.num_starved
+    step_stats = results.step_stats
         
     print("")
     print("")
    
-    print("The maze has {0} cells".format( maze.getHeight() * maze.getWidth()))
+    print("The maze has {0} cells, {1} of them reachable from the start".format(
+          maze.getHeight() * maze.getWidth(), maze.getNumReachableCells()))
+    shortest_path_length = maze.getShortestPathLength()
+    print("The shortest path from the start to the destination is {0} steps".format(
+          shortest_path_length))
  
    
     print("  {0} ({1:.1%}) of the trials succeeded".format(num_succeeded, num_succeeded/num_trials))
     print("  In {0} ({1:.1%}) of the trials the rat got stuck".format(num_stuck, num_stuck/num_trials))
     print("  In {0} ({1:.1%}) of the trials the rat starved".format(num_starved, num_starved/num_trials))
     if num_succeeded > 0:
-        trials_array = np.array(trial_steps)
         print("")
         print("  Number of steps stats:")
-        print("     Minium:        {:5d}".format(min(trials_array)))
-        print("     Num with min:  {0:5d}".format(trial_steps.count(min(trials_array))))
-        print("     Maximum:       {0:5d}".format(max(trials_array)))
-        print("     Mean:          {0:5.1f}".format(np.mean(trials_array)))
-        print("     Std Deviation: {0:5.1f}".format(np.std(trials_array)))
-        print("     Median:        {0:5.1f}".format(np.median(trials_array)))
-    
-        pylab.hist(trials_array,bins=50)
+        print("     Minium:        {:5d}".format(step_stats.min_steps))
+        print("     Num with min:  {0:5d}".format(step_stats.num_with_min))
+        print("     Maximum:       {0:5d}".format(step_stats.max_steps))
+        print("     Mean:          {0:5.1f}".format(step_stats.mean))
+        print("     Std Deviation: {0:5.1f}".format(step_stats.getStdDev()))
+        print("     Median:        {0:5.1f}".format(step_stats.getMedian()))
+        print("")
+        print("  Efficiency (shortest path / steps):")
+        print("     Best:          {0:5.1%}".format(shortest_path_length / step_stats.min_steps))
+        print("     Mean:          {0:5.1%}".format(
+              step_stats.getMeanEfficiency(shortest_path_length)))
+    
+        edges, counts = step_stats.getHistogram(50)
+        pylab.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
         pylab.xlabel("Number of steps to solve maze")
         pylab.ylabel("Number of occurences")
         pylab.title("Histogram of number of steps to solve maze\n {0} with rat {1}"
@@ -100,7 +474,145 @@ def run_maze_trials( num_trials, maze_file_name, rat_type, num_rats=1 ):
         pylab.show()
         
         
+def score_deterministic_rat( maze_file_names, rat_type ):
+    """
+    Score the deterministic rat "rat_type" over all of the mazes in "maze_file_names" using the
+    compiled transition tables in MazeCompiler, so that doTurn is never called for the same state
+    twice. Prints how many runs succeeded, got stuck or starved and returns a list of the
+    (Outcome, number of steps) of each maze
+    """
+    scores = [MazeCompiler.evaluateRat(Maze(filename=name), rat_type) for name in maze_file_names]
+    
+    print("")
+    print("Scored rat {0} over {1} mazes".format(rat_type.__name__, len(scores)))
+    for outcome in Outcome:
+        num_outcome = sum(1 for score in scores if score[0] == outcome)
+        print("  {0:10s} {1:6d} ({2:.1%})".format(outcome.name.lower(), num_outcome,
+              num_outcome/max(1,len(scores))))
+    
+    successful_steps = [score[1] for score in scores if score[0] == Outcome.SUCCEEDED]
+    if successful_steps:
+        print("  Mean steps of the successful runs: {0:.1f}".format(np.mean(successful_steps)))
+    return scores
+        
+        
+def profile_maze_trials( *args, sort_by='cumulative', num_lines=30, profile_file_name=None,
+                         **kwargs ):
+    """
+    Run run_maze_trials with the given arguments under cProfile and print the "num_lines" most
+    expensive functions sorted by "sort_by". The profile is saved to "profile_file_name" if it is
+    given, and the pstats.Stats are returned.
+    
+    Only the main process is profiled, so use a single worker.
+    """
+    profiler = cProfile.Profile()
+    profiler.runcall(run_maze_trials, *args, **kwargs)
+    if profile_file_name:
+        profiler.dump_stats(profile_file_name)
+        
+    stats = pstats.Stats(profiler)
+    stats.sort_stats(sort_by).print_stats(num_lines)
+    return stats
+    
+    
+def time_maze_phases( num_trials, maze_file_name, rat_type, num_rats=1, seed=None ):
+    """
+    Run "num_trials" trials with Maze instrumentation on and print how the time of a step splits
+    between its phases and the rat classes, to show whether the rats or the engine are the
+    bottleneck. Returns the dict from Maze.getInstrumentation
+    """
+    random.seed(seed)
+    maze = Maze(filename=maze_file_name, mmap_mode='r')
+    maze.setHeadless()
+    maze.setRecordSteps(False)
+    maze.setInstrumentation()
+    for trial in range(num_trials):
+        maze.reset()
+        for irat in range(num_rats):
+            maze.addRat(rat_type())
+        try:
+            maze.run()
+        except (RatStuck, RatStarved):
+            pass
+    
+    timings = maze.getInstrumentation()
+    total = max(timings['total'], 1e-12)
+    print("")
+    print("Time per phase over {0} steps:".format(timings['num_steps']))
+    for phase, seconds in timings['phases'].items():
+        print("  {0:10s} {1:8.3f}s {2:6.1%}".format(phase, seconds, seconds/total))
+    for name, rat in timings['rats'].items():
+        print("  {0} doTurn: {1:.2f}us per turn".format(name, 1e6*rat['time']/max(1,rat['turns'])))
+    return timings
+        
+        
+def testStats():
+    """
+    Check the step statistics against numpy, whether the trials are added one at a time, as an
+    array or merged from several parts, and that merged results keep the first best trial
+    """
+    print("Testing statistics")
+    rng = np.random.default_rng(1)
+    for max_steps, num_bins in ((300, MAX_HISTOGRAM_BINS), (3000, 64)):
+        for num_trials in (499, 500):
+            steps = rng.integers(1, max_steps+1, num_trials)
+            steps[::50] = steps.min()       # Several trials with the fewest steps
+            
+            one_at_a_time = StepStatistics(max_steps, num_bins)
+            for num_steps in steps:
+                one_at_a_time.add(int(num_steps))
+            as_array = StepStatistics(max_steps, num_bins)
+            as_array.addMany(steps)
+            merged = StepStatistics(max_steps, num_bins)
+            for part in np.split(steps, [0, 10, 11, 200]):
+                part_stats = StepStatistics(max_steps, num_bins)
+                part_stats.addMany(part)
+                merged.merge(part_stats)
+                
+            for stats in (one_at_a_time, as_array, merged):
+                assert((stats.bin_width == 1) == (num_bins == MAX_HISTOGRAM_BINS))
+                assert(stats.count == num_trials)
+                assert(stats.min_steps == steps.min() and stats.max_steps == steps.max())
+                assert(stats.num_with_min == np.count_nonzero(steps == steps.min()))
+                assert(np.isclose(stats.mean, steps.mean()))
+                assert(np.isclose(stats.getVariance(), steps.var()))
+                assert(np.isclose(stats.getMeanEfficiency(2), (2.0 / steps).mean()))
+                assert((stats.histogram == np.bincount(steps // stats.bin_width,
+                                                       minlength=stats.histogram.size)).all())
+                if stats.bin_width == 1:
+                    assert(stats.getMedian() == np.median(steps))
+                else:
+                    assert(abs(stats.getMedian() - np.median(steps)) <= stats.bin_width)
+                edges, counts = stats.getHistogram(50)
+                assert(counts.sum() == num_trials and edges[0] <= steps.min() < steps.max() < edges[-1])
+                
+    # The first trial found with the fewest steps is the best, whichever part it is in:
+    first = TrialResults(100)
+    first.addSuccess(20, seed=1)
+    first.addSuccess(10, seed=2)
+    first.addSuccess(10, seed=3)
+    first.num_stuck = 1
+    second = TrialResults(100)
+    second.addSuccess(10, seed=4)
+    second.num_starved = 2
+    first.merge(second)
+    assert(first.best_seed == 2 and first.min_steps == 10)
+    assert(first.getNumTrials() == 7 and first.step_stats.num_with_min == 3)
+    third = TrialResults(100)
+    third.num_stuck = 1
+    first.merge(third)
+    assert(first.best_seed == 2)
+    batch = TrialResults(100)
+    batch.addSuccess(9, seed=5, trial=3, batch_trials=8)
+    first.merge(batch)
+    assert((first.best_seed, first.best_trial, first.batch_trials) == (5, 3, 8))
+    print("All tests passed")
+    
+    
 if __name__=='__main__':
     
-    run_maze_trials(500, 'maze5.npy', Rat.WallFollower, 1)
+    if '--test' in sys.argv:
+        testStats()
+    else:
+        run_maze_trials(500, 'maze5.npy', Rat.WallFollower, 1)
     
\ No newline at end of file
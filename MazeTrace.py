@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:20:44 2026
+
+@author: que
+
+Compact binary step traces, the format of the .stp files written by Maze.saveSteps.
+
+A trace is a header followed by fixed size blocks of BLOCK_STEPS steps:
+
+    header - MAGIC, version (uint16), number of rats (uint16), steps per block (uint32),
+             number of steps (uint64) and the Maze.getContentHash digest of the maze (20 bytes)
+    block  - a keyframe of the rats' positions (int16 i,j per rat) and heading codes (uint8 per
+             rat) before the first step of the block, then one nibble per rat per step
+
+Each nibble holds the rat's heading code after its turn (bits 0-1) and whether it then moved
+one cell that way (bit 2), two nibbles to a byte with the first in the low bits. A step of a
+single rat takes half a byte, so a trace of a million steps is about half a megabyte.
+
+Traces are written a block at a time as the simulation runs. Only the last block may be short,
+so block n always starts at the same offset and the keyframes act as an index: the state after any
+step is found by reading the one block that holds it. Older .stp
+files, pickled lists of (directions, positions) tuples, are read by PickledTrace.
+
+"""
+
+import pickle
+import struct
+import numpy as np
+
+import Maze
+
+
+MAGIC = b'MZTR'
+VERSION = 1
+BLOCK_STEPS = 4096          # Steps per block
+
+# Little-endian magic, version, number of rats, steps per block, number of steps, maze digest
+HEADER = struct.Struct('<4sHHIQ20s')
+NUM_STEPS_OFFSET = 12       # Offset of the number of steps in the header
+
+
+def getBlockSize(num_rats, block_steps):
+    """
+    Return the number of bytes in each block of a trace
+    """
+    return num_rats*5 + (block_steps*num_rats + 1) // 2
+
+
+class TraceWriter(object):
+    """
+    Writes a trace one step at a time. The positions and directions (0, 90, 180 or 270) of the
+    rats before the first step are given when the trace is created, then addStep is called with
+    their directions and positions after each step
+    """
+
+    def __init__(self, filename, maze_hash, positions, directions, block_steps=BLOCK_STEPS):
+        self.file = open(filename, 'wb')
+        self.num_rats = len(positions)
+        self.block_steps = block_steps
+        self.num_steps = 0
+        self.positions = [tuple(pos) for pos in positions]
+        self.headings = [(direction//90) % 4 for direction in directions]
+        self.nibbles = []
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.num_rats, block_steps, 0,
+                                    bytes.fromhex(maze_hash) if maze_hash else bytes(20)))
+        self.keyframe = self.packKeyframe()
+
+    def packKeyframe(self):
+        """
+        Return the keyframe bytes for the current positions and headings
+        """
+        return (np.array(self.positions, dtype='<i2').tobytes() +
+                np.array(self.headings, dtype=np.uint8).tobytes())
+
+    def addStep(self, directions, positions):
+        """
+        Add a step given the direction and position of each rat after it. Rats missing from the
+        end of positions didn't move, as when an earlier rat reached the destination
+        """
+        for irat in range(self.num_rats):
+            heading = (directions[irat]//90) % 4 if irat < len(directions) else self.headings[irat]
+            old = self.positions[irat]
+            new = tuple(positions[irat]) if irat < len(positions) else old
+            moved = new != old
+            if moved:
+                di, dj = Maze.HEADING_OFFSETS[heading]
+                if new != (old[0]+di, old[1]+dj):
+                    raise ValueError("Rat {0} moved from {1} to {2} with heading {3}"
+                                     .format(irat, old, new, heading*90))
+            self.nibbles.append(heading | (moved << 2))
+            self.positions[irat] = new
+            self.headings[irat] = heading
+
+        self.num_steps += 1
+        if self.num_steps % self.block_steps == 0:
+            self.writeBlock()
+
+    def writeBlock(self):
+        """
+        Write the steps since the last keyframe as a block
+        """
+        nibbles = np.zeros(len(self.nibbles) + 1, dtype=np.uint8)
+        nibbles[:len(self.nibbles)] = self.nibbles
+        packed = nibbles[0:-1:2] | (nibbles[1::2] << 4)
+        self.file.write(self.keyframe + packed.tobytes())
+        self.keyframe = self.packKeyframe()
+        self.nibbles = []
+
+    def close(self):
+        """
+        Write the last block and the number of steps, and close the file
+        """
+        if self.file is None:
+            return
+        if self.nibbles:
+            self.writeBlock()
+        self.file.seek(NUM_STEPS_OFFSET)
+        self.file.write(struct.pack('<Q', self.num_steps))
+        self.file.close()
+        self.file = None
+
+
+class TraceReader(object):
+    """
+    Reads a trace written by TraceWriter
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        magic, version, self.num_rats, self.block_steps, self.num_steps, digest = \
+            HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            self.file.close()
+            raise ValueError("{0} is not a maze trace".format(filename))
+        if version > VERSION:
+            self.file.close()
+            raise ValueError("{0} has trace version {1}, only up to {2} can be read"
+                             .format(filename, version, VERSION))
+        self.maze_hash = digest.hex() if any(digest) else None
+        self.block_size = getBlockSize(self.num_rats, self.block_steps)
+        self.block = None       # The last block read, as (block, arrays)
+
+    def readBlock(self, block):
+        """
+        Return the keyframe positions (rats,2) and heading codes (rats) at the start of the given
+        block, and arrays of the positions (steps,rats,2) and heading codes (steps,rats) after each
+        of its steps. The last block read is kept, so reading steps close together is cheap
+        """
+        if self.block is not None and self.block[0] == block:
+            return self.block[1]
+        
+        self.file.seek(HEADER.size + block*self.block_size)
+        data = np.zeros(self.block_size, dtype=np.uint8)
+        block_data = self.file.read(self.block_size)
+        data[:len(block_data)] = np.frombuffer(block_data, dtype=np.uint8)
+        num_rats = self.num_rats
+        key_positions = data[:num_rats*4].view('<i2').reshape(num_rats, 2).astype(np.int64)
+        key_headings = data[num_rats*4:num_rats*5].astype(np.int64)
+
+        num_steps = max(0, min(self.block_steps, self.num_steps - block*self.block_steps))
+        packed = data[num_rats*5:]
+        nibbles = np.empty(packed.size*2, dtype=np.uint8)
+        nibbles[0::2] = packed & 0xF
+        nibbles[1::2] = packed >> 4
+        nibbles = nibbles[:num_steps*num_rats].reshape(num_steps, num_rats)
+
+        headings = (nibbles & 3).astype(np.int64)
+        moves = np.array(Maze.HEADING_OFFSETS)[headings] * (nibbles >> 2)[:,:,None]
+        result = (key_positions, key_headings, key_positions + np.cumsum(moves, axis=0), headings)
+        self.block = (block, result)
+        return result
+
+    def getState(self, step):
+        """
+        Return the (directions, positions) of the rats after the given number of steps, 0 for
+        where they started. Only the block holding the step is read
+        """
+        if step < 0 or step > self.num_steps:
+            raise IndexError("Step {0} is not in the trace of {1} steps".format(step, self.num_steps))
+        if step == 0:
+            positions, headings = self.readBlock(0)[:2]
+        else:
+            block, index = divmod(step-1, self.block_steps)
+            positions, headings = [a[index] for a in self.readBlock(block)[2:]]
+        return (headings*90).tolist(), [tuple(pos) for pos in positions.tolist()]
+
+    def iterSteps(self, start_step=0):
+        """
+        Generate the (directions, positions) of the rats after each step following start_step, a
+        block at a time
+        """
+        num_blocks = -(-self.num_steps // self.block_steps)
+        for block in range(start_step // self.block_steps, num_blocks):
+            positions, headings = self.readBlock(block)[2:]
+            first = max(0, start_step - block*self.block_steps)
+            for step_pos, step_heading in zip(positions[first:].tolist(),
+                                              (headings[first:]*90).tolist()):
+                yield step_heading, [tuple(pos) for pos in step_pos]
+
+    def close(self):
+        self.file.close()
+
+
+class PickledTrace(object):
+    """
+    Reads the steps from an older pickled step file with the same interface as TraceReader.
+    These files don't say where the rats started, so that is given as start
+    """
+
+    def __init__(self, filename, start=None):
+        with open(filename, 'rb') as f:
+            self.steps = pickle.load(f)
+        self.num_rats = len(self.steps[0][0]) if self.steps else 0
+        self.num_steps = len(self.steps)
+        self.maze_hash = None
+        self.start = start
+        
+        # The rats after the one that reached the destination are missing from the last step
+        if self.steps and len(self.steps[-1][1]) < self.num_rats:
+            directions, positions = self.steps[-1]
+            last = self.getState(self.num_steps-1)
+            self.steps[-1] = (directions + last[0][len(directions):],
+                              positions + last[1][len(positions):])
+
+    def getState(self, step):
+        """
+        Return the (directions, positions) of the rats after the given number of steps
+        """
+        if step < 0 or step > self.num_steps:
+            raise IndexError("Step {0} is not in the trace of {1} steps".format(step, self.num_steps))
+        if step == 0:
+            return [90]*self.num_rats, [self.start]*self.num_rats
+        return self.steps[step-1]
+
+    def iterSteps(self, start_step=0):
+        """
+        Generate the (directions, positions) of the rats after each step following start_step
+        """
+        for istep in range(start_step, self.num_steps):
+            yield self.steps[istep]
+
+    def close(self):
+        pass
+
+
+def openTrace(filename, start=None):
+    """
+    Return a TraceReader for filename, or a PickledTrace if it is an older pickled step file in
+    which the rats started at start
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        return TraceReader(filename)
+    return PickledTrace(filename, start)
+
+
+def writeSteps(filename, steps, maze_hash, positions, directions, block_steps=BLOCK_STEPS):
+    """
+    Write a list of steps in the form of Maze.steps as a trace. positions and directions are
+    those of the rats before the first step
+    """
+    writer = TraceWriter(filename, maze_hash, positions, directions, block_steps)
+    for directions, positions in steps:
+        writer.addStep(directions, positions)
+    writer.close()
+
+
+def testTrace():
+    """
+    Check traces read back the steps they were written with
+    """
+    import os
+    import shutil
+    import tempfile
+    from Maze import CellType, RatStuck, RatStarved
+    import Rat
+
+    print("Testing traces")
+    maze = Maze.Maze(12,9)
+    for j in range(1,6):
+        maze.setCellType(5, j, CellType.WALL)
+    maze.setCellType(1, 1, CellType.START)
+    maze.setCellType(9, 2, CellType.DESTINATION)
+
+    # Two random rats, with a small block size so the steps span several blocks:
+    import random
+    random.seed(5)
+    maze.setHeadless()
+    maze.addRat(Rat.RandomRat())
+    maze.addRat(Rat.RandomRat())
+    try:
+        maze.run()
+    except (RatStuck, RatStarved):
+        pass
+    steps = maze.steps
+    assert(len(steps) > 20)
+
+    directory = tempfile.mkdtemp()
+    try:
+        TRACE_FILE = os.path.join(directory, 'test_trace.stp')
+        writeSteps(TRACE_FILE, steps, maze.getContentHash(), [maze.getStart()]*2, [90,90],
+                   block_steps=7)
+        reader = openTrace(TRACE_FILE)
+        assert(isinstance(reader, TraceReader))
+        assert(reader.num_rats == 2 and reader.num_steps == len(steps))
+        assert(reader.maze_hash == maze.getContentHash())
+        for (directions, positions), (dir2, pos2) in zip(steps, reader.iterSteps()):
+            assert(directions == dir2)
+            assert(positions == pos2[:len(positions)])
+        
+        # Seeking to any step, and reading on from it:
+        assert(reader.getState(0) == ([90,90], [maze.getStart()]*2))
+        for step in (len(steps), 7, 8, 1, 15, 3):
+            directions, positions = reader.getState(step)
+            assert(directions == steps[step-1][0])
+            assert(positions[:len(steps[step-1][1])] == steps[step-1][1])
+        rest = list(reader.iterSteps(15))
+        assert(len(rest) == len(steps)-15 and rest[0][0] == steps[15][0])
+        reader.close()
+
+        # A million steps of a single rat take about half a megabyte:
+        writer = TraceWriter(TRACE_FILE, None, [(1,1)], [90])
+        for istep in range(1000000):
+            writer.addStep([0], [(1,1)])
+        writer.close()
+        assert(os.path.getsize(TRACE_FILE) < 600000)
+
+        # Older pickled step files:
+        with open(TRACE_FILE, 'wb') as f:
+            pickle.dump(steps, f)
+        reader = openTrace(TRACE_FILE, maze.getStart())
+        assert(isinstance(reader, PickledTrace))
+        assert(len(list(reader.iterSteps())) == len(steps))
+        assert(reader.getState(0) == ([90,90], [maze.getStart()]*2))
+        assert(list(reader.iterSteps(10))[0] == reader.getState(11))
+    finally:
+        shutil.rmtree(directory)
+    print("All tests passed")
+
+
+if __name__ == '__main__':
+    testTrace()
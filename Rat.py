@@ -14,41 +14,148 @@ from abc import ABCMeta,abstractmethod
 
 import Maze
 import random
+import numpy as np
+
+
+# Heading codes 0-3 stand for the directions 0, 90, 180 and 270 degrees. These tables give the
+# heading code after turnLeft, turnRight and turnAround, indexed by the current heading code.
+# turnAround wraps 180 degrees round to 90 rather than 0 and AROUND_TURN keeps that behaviour
+LEFT_TURN = (3,0,1,2)
+RIGHT_TURN = (1,2,3,0)
+AROUND_TURN = (2,3,1,1)
+
+# Codes for the turn a rat makes in a step, used by the batch engines
+TURN_NONE = 0
+TURN_RIGHT = 1
+TURN_AROUND = 2
+TURN_LEFT = 3
+
+# The heading code after each turn code (index) from each heading code
+TURN_HEADINGS = ((0,1,2,3), RIGHT_TURN, AROUND_TURN, LEFT_TURN)
+
+# Bits of the relative wall masks passed to doBatchTurn
+FRONT_WALL = 1
+RIGHT_WALL = 2
+BEHIND_WALL = 4
+LEFT_WALL = 8
+
+
+def getTurnCode(heading, new_heading):
+    """
+    Return the code of a turn which takes a rat from heading to new_heading (both heading codes)
+    """
+    for turn,headings in enumerate(TURN_HEADINGS):
+        if headings[heading] == new_heading:
+            return turn
+    raise ValueError("No turn from heading {0} to {1}".format(heading, new_heading))
+
+
+def describesTurns(rat_type, name):
+    """
+    Return True if the attribute name of rat_type comes from the class which defines its doTurn
+    or a subclass of it. One inherited from above that class doesn't describe the rat's turns
+    """
+    def owner(name):
+        return next(cls for cls in rat_type.__mro__ if name in cls.__dict__)
+    
+    return issubclass(owner(name), owner('doTurn'))
+
+
+def isDeterministic(rat_type):
+    """
+    Return True if rats of rat_type turn the same way every time they are in the same state. A
+    subclass which overrides doTurn must set deterministic itself
+    """
+    return rat_type.deterministic and describesTurns(rat_type, 'deterministic')
+
+
+def getBatchPolicy(rat_type):
+    """
+    Return the doBatchTurn of rat_type, or None if it only has a scalar doTurn
+    """
+    if rat_type.doBatchTurn is None or not describesTurns(rat_type, 'doBatchTurn'):
+        return None
+    return rat_type.doBatchTurn
+
+
+def goesStraightUntilWall(rat_type):
+    """
+    Return True if rats of rat_type never turn while there is no wall in front of them, so that
+    Maze.run can skip along corridors
+    """
+    return rat_type.straight_until_wall and describesTurns(rat_type, 'straight_until_wall')
+
+
+def squaredDistances(positions, headings, destination):
+    """
+    Return arrays of the squared distances to destination from the positions (n,2), and from the
+    cells to their left and right given the heading codes, as the smelling rats measure them
+    """
+    offsets = np.array(Maze.HEADING_OFFSETS)
+    dest = np.asarray(destination)
+    current = ((dest - positions)**2).sum(axis=1)
+    left = ((dest - positions - offsets[(headings+3) % 4])**2).sum(axis=1)
+    right = ((dest - positions - offsets[(headings+1) % 4])**2).sum(axis=1)
+    return current, left, right
 
 
 class RatBase(metaclass=ABCMeta):
     """
     An abstract base class for the Rat behavior. Defines the basic movement
     behavior but can't be directly instantiated, only subclassed
+    
+    Subclasses whose turns depend only on their location, direction and the LocationInfo (no
+    random numbers or other state) should set deterministic to True. The maze can then tell
+    when such a rat is going round in circles.
+    
+    The direction is held as a heading code 0-3 (direction//90) and turns are lookups in the
+    turn tables. getDirection, setDirection and the direction property give it in degrees.
+    The state is kept in slots so it is small and quick to copy with getState and setState.
+    image holds the canvas item a MazeView draws the rat with.
+    
+    Subclasses can also give a classmethod doBatchTurn(wall_bits, positions, headings, destination,
+    rng) making the turns of many rats of the class at once for the batch engines. It takes arrays
+    of the relative wall bits (FRONT_WALL etc.), positions (n,2) and heading codes of n rats, the
+    destination and a NumPy random generator, and returns an array of turn codes (TURN_*). Rats
+    without one are run by the batch engines one rat at a time with doTurn, see getBatchPolicy.
     """
     
+    __slots__ = ('heading', 'location', 'last_location', 'num_same_location', 'image')
+    
+    deterministic = False
+    straight_until_wall = False     # Set if doTurn never turns without a wall in front
+    doBatchTurn = None              # Optional classmethod making the turns of many rats at once
+    
     def __init__(self):
-        self.direction = 90   # One of 0,90,180,270
+        self.heading = 1      # Heading code, direction 90
         self.location = None
         self.last_location = None
         self.num_same_location = 0
+        self.image = None
         
         
     def getDirection(self):
-        return self.direction
+        return self.heading*90
     
     def setDirection(self, direction):
-        self.direction=direction
+        self.heading = (direction//90) % 4
+        
+    direction = property(getDirection, setDirection, doc="The direction in degrees, one of 0,90,180,270")
+    
+    def getHeading(self):
+        return self.heading
+    
+    def setHeading(self, heading):
+        self.heading = heading
 
     def turnLeft(self):
-        self.direction -= 90
-        if self.direction < 0:
-            self.direction = 270
+        self.heading = LEFT_TURN[self.heading]
     
     def turnRight(self):
-        self.direction += 90
-        if self.direction >=360 :
-            self.direction = 0
+        self.heading = RIGHT_TURN[self.heading]
             
     def turnAround(self):
-        self.direction += 180
-        if self.direction >= 360:
-            self.direction = 90
+        self.heading = AROUND_TURN[self.heading]
             
     def setLocation(self, loc):
         if self.last_location == loc:
@@ -67,6 +174,19 @@ class RatBase(metaclass=ABCMeta):
     def getLastLocation(self):
         return self.last_location
     
+    def getState(self):
+        """
+        Return a tuple of the location, heading code, last location and stuck count, which
+        together with the LocationInfo decide what a deterministic rat does next
+        """
+        return (self.location, self.heading, self.last_location, self.num_same_location)
+    
+    def setState(self, state):
+        """
+        Restore a state returned by getState
+        """
+        self.location, self.heading, self.last_location, self.num_same_location = state
+    
     
 
     
@@ -83,6 +203,24 @@ class RatBase(metaclass=ABCMeta):
         """
         pass
     
+    def getTurnProbabilities(self, loc_info):
+        """
+        Return a list of (probability, turn) pairs giving the chance of each turn (one of the TURN_*
+        codes) the rat could make in doTurn given loc_info. Used to solve the maze exactly rather
+        than by running trials.
+        
+        This works for deterministic rats by letting the rat make its turn and then undoing it.
+        Rats which make random turns must override it.
+        """
+        if not isDeterministic(type(self)):
+            raise NotImplementedError("{0} doesn't provide its turn probabilities".format(
+                                      type(self).__name__))
+        direction = self.getDirection()
+        self.doTurn(loc_info)
+        turn = getTurnCode((direction//90) % 4, (self.getDirection()//90) % 4)
+        self.setDirection(direction)
+        return [(1.0, turn)]
+    
     
     
     
@@ -91,6 +229,11 @@ class DumbRat(RatBase):
     """
     A dumb rat, doesn't actually ever turn
     """
+
+    __slots__ = ()
+    
+    deterministic = True
+    straight_until_wall = True
     
     def __init__(self):
         super().__init__()
@@ -114,6 +257,13 @@ class DumbRat(RatBase):
         """
         
         return 
+    
+    @classmethod
+    def doBatchTurn(cls, wall_bits, positions, headings, destination, rng):
+        """
+        DumbRat never turns
+        """
+        return np.full(len(headings), TURN_NONE, dtype=np.intp)
  
     
 
@@ -121,6 +271,11 @@ class TurnLeftRat(RatBase):
         """
         This rat always turns left when faced with a wall!
         """
+
+        __slots__ = ()
+        
+        deterministic = True
+        straight_until_wall = True
     
     
     
@@ -143,6 +298,13 @@ class TurnLeftRat(RatBase):
         
             if loc_info.front_wall:
                 self.turnLeft()
+                
+        @classmethod
+        def doBatchTurn(cls, wall_bits, positions, headings, destination, rng):
+            """
+            Turn left when faced with a wall
+            """
+            return np.where(wall_bits & FRONT_WALL, TURN_LEFT, TURN_NONE)
     
 
 
@@ -151,6 +313,8 @@ class RandomRat(RatBase):
         """
         This rat makes random turns
         """
+
+        __slots__ = ()
     
     
     
@@ -180,6 +344,38 @@ class RandomRat(RatBase):
                         self.turnLeft()
                     else:
                         self.turnRight()
+                        
+        def getTurnProbabilities(self, loc_info):
+            """
+            Return the (probability, turn) pairs of the turns doTurn makes
+            """
+            p_left = 0.0 if loc_info.left_wall else 0.05
+            p_right = 0.0 if loc_info.right_wall else 0.10 - p_left
+            p_none = 1.0 - p_left - p_right
+            if loc_info.front_wall:
+                p_wall_left = 0.0 if loc_info.left_wall else 0.5
+                p_left += p_none * p_wall_left
+                p_right += p_none * (1.0 - p_wall_left)
+                p_none = 0.0
+            return [(p_none, TURN_NONE), (p_left, TURN_LEFT), (p_right, TURN_RIGHT)]
+        
+        @classmethod
+        def doBatchTurn(cls, wall_bits, positions, headings, destination, rng):
+            """
+            Random turns, and left or right at random when faced with a wall
+            """
+            n = len(headings)
+            r = rng.random(n)
+            r2 = rng.random(n)
+            left_open = (wall_bits & LEFT_WALL) == 0
+            right_open = (wall_bits & RIGHT_WALL) == 0
+            front_wall = (wall_bits & FRONT_WALL) != 0
+            
+            random_left = (r < 0.05) & left_open
+            random_right = ~random_left & (r < 0.10) & right_open
+            wall_left = (r2 < 0.5) & left_open
+            return np.select([random_left, random_right, front_wall & wall_left, front_wall],
+                             [TURN_LEFT, TURN_RIGHT, TURN_LEFT, TURN_RIGHT], TURN_NONE)
                     
             
             
@@ -187,6 +383,8 @@ class SmellingRat(RatBase):
         """
         This rat can smell the cheese and will try and turn towards it
         """
+
+        __slots__ = ()
     
         def distanceToDest( self, loc, dest):
             """
@@ -231,10 +429,52 @@ class SmellingRat(RatBase):
                     else:
                         self.turnRight()
                         
+        def getTurnProbabilities(self, loc_info):
+            """
+            Return the (probability, turn) pairs of the turns doTurn makes
+            """
+            p_left = 0.0
+            p_right = 0.0
+            
+            # Turn towards the cheese 20% of the time:
+            if (self.distanceToDest(loc_info.left_loc,loc_info.destination) <
+                    self.distanceToDest(loc_info.right_loc, loc_info.destination) and not
+                    loc_info.left_wall):
+                p_left += 0.2
+            elif not loc_info.right_wall:
+                p_right += 0.2
+                
+            if loc_info.front_wall:
+                p_wall_left = 0.0 if loc_info.left_wall else 0.5
+                p_left += 0.8 * p_wall_left
+                p_right += 0.8 * (1.0 - p_wall_left)
+            return [(1.0 - p_left - p_right, TURN_NONE), (p_left, TURN_LEFT), (p_right, TURN_RIGHT)]
+        
+        @classmethod
+        def doBatchTurn(cls, wall_bits, positions, headings, destination, rng):
+            """
+            Turn towards the cheese a fifth of the time, otherwise left or right at random when
+            faced with a wall
+            """
+            n = len(headings)
+            r = rng.random(n)
+            r2 = rng.random(n)
+            current, left, right = squaredDistances(positions, headings, destination)
+            left_open = (wall_bits & LEFT_WALL) == 0
+            right_open = (wall_bits & RIGHT_WALL) == 0
+            front_wall = (wall_bits & FRONT_WALL) != 0
+            
+            smell = r < 0.2
+            return np.select([smell & (left < right) & left_open, smell & right_open, smell,
+                              front_wall & (r2 < 0.5) & left_open, front_wall],
+                             [TURN_LEFT, TURN_RIGHT, TURN_NONE, TURN_LEFT, TURN_RIGHT], TURN_NONE)
+                        
 class SmellingRat2(RatBase):
         """
         This rat can smell the cheese and will try and turn towards it
         """
+
+        __slots__ = ()
     
         def distanceToDest( self, loc, dest):
             """
@@ -291,12 +531,64 @@ class SmellingRat2(RatBase):
                         self.turnLeft()
                 if not loc_info.right_wall and (dist_from_right < dist_from_current and r < 0.5):
                         self.turnRight
+                        
+        def getTurnProbabilities(self, loc_info):
+            """
+            Return the (probability, turn) pairs of the turns doTurn makes. doTurn only depends on
+            whether its random number is below 0.5, so each half gives one turn
+            """
+            dist_from_current = self.distanceToDest(loc_info.location, loc_info.destination)
+            closer_left = self.distanceToDest(loc_info.left_loc, loc_info.destination) < dist_from_current
+            closer_right = self.distanceToDest(loc_info.right_loc, loc_info.destination) < dist_from_current
+            
+            turns = []
+            for r_below_half in (True, False):
+                if loc_info.front_wall:
+                    if not loc_info.left_wall and (closer_left or r_below_half):
+                        turn = TURN_LEFT
+                    elif not loc_info.right_wall and (closer_right or r_below_half):
+                        turn = TURN_RIGHT
+                    elif loc_info.left_wall and loc_info.right_wall:
+                        turn = TURN_AROUND
+                    elif not loc_info.left_wall:
+                        turn = TURN_LEFT
+                    else:
+                        turn = TURN_RIGHT
+                elif not loc_info.left_wall and (closer_left or r_below_half):
+                    turn = TURN_LEFT
+                else:
+                    turn = TURN_NONE    # doTurn never actually calls turnRight here
+                turns.append((0.5, turn))
+            return turns
+        
+        @classmethod
+        def doBatchTurn(cls, wall_bits, positions, headings, destination, rng):
+            """
+            Turn towards the cheese, or at random half of the time
+            """
+            r_below_half = rng.random(len(headings)) < 0.5
+            current, left, right = squaredDistances(positions, headings, destination)
+            left_open = (wall_bits & LEFT_WALL) == 0
+            right_open = (wall_bits & RIGHT_WALL) == 0
+            front_wall = (wall_bits & FRONT_WALL) != 0
+            go_left = left_open & ((left < current) | r_below_half)
+            go_right = right_open & ((right < current) | r_below_half)
+            
+            return np.select([front_wall & go_left, front_wall & go_right,
+                              front_wall & ~left_open & ~right_open, front_wall & left_open,
+                              front_wall, go_left],
+                             [TURN_LEFT, TURN_RIGHT, TURN_AROUND, TURN_LEFT, TURN_RIGHT, TURN_LEFT],
+                             TURN_NONE)
                     
                             
 class WallFollower(RatBase):
         """
         This rat follows the right hand rule. Given a choice it will turn right
         """
+
+        __slots__ = ()
+        
+        deterministic = True
     
       
     
@@ -322,6 +614,18 @@ class WallFollower(RatBase):
             elif loc_info.right_wall and loc_info.left_wall and loc_info.front_wall:
                 self.turnAround()
                 
+        @classmethod
+        def doBatchTurn(cls, wall_bits, positions, headings, destination, rng):
+            """
+            Follow the right hand rule
+            """
+            right_open = (wall_bits & RIGHT_WALL) == 0
+            left_open = (wall_bits & LEFT_WALL) == 0
+            front_wall = (wall_bits & FRONT_WALL) != 0
+            
+            return np.select([right_open, left_open & front_wall, front_wall],
+                             [TURN_RIGHT, TURN_LEFT, TURN_AROUND], TURN_NONE)
+                
 
 
 
@@ -389,7 +693,75 @@ def testRat():
     dr.turnAround()
     assert(dr.getDirection() == 90)
     
+    # The heading codes behind the directions, and the state:
+    dr.direction = 180
+    assert(dr.getHeading() == 2 and dr.getDirection() == 180)
+    dr.setLocation((1,2))
+    dr.setLocation((1,2))
+    state = dr.getState()
+    assert(state == ((1,2), 2, (1,2), 0))
+    other = DumbRat()
+    other.setState(state)
+    assert(other.getState() == state and other.direction == 180)
+    try:
+        dr.extra = 1
+        assert(False)
+    except AttributeError:
+        pass    # Slots only
+    
+    testBatchTurns()
+    
     print("All tests passed")
+
+
+def testBatchTurns():
+    """
+    Check doBatchTurn makes the same turns as doTurn, with the same probabilities for the rats
+    which turn at random, for every combination of walls and heading. The new headings are
+    compared as turning around from 180 and turning left both give 90
+    """
+    from types import SimpleNamespace
+    
+    num_samples = 20000
+    rng = np.random.default_rng(1)
+    destination = (5,2)
+    for rat_type in (DumbRat, TurnLeftRat, RandomRat, SmellingRat, SmellingRat2, WallFollower):
+        assert(getBatchPolicy(rat_type) is not None)
+        rat = rat_type()
+        for position in ((1,1), (6,6), (5,3)):
+            for heading in range(4):
+                for wall_bits in range(16):
+                    # The LocationInfo the rat sees, with the walls relative to its heading:
+                    loc_info = SimpleNamespace(location=position, destination=destination)
+                    for bit,side,turn in ((FRONT_WALL,'front',0), (RIGHT_WALL,'right',1),
+                                          (BEHIND_WALL,'behind',2), (LEFT_WALL,'left',3)):
+                        di,dj = Maze.HEADING_OFFSETS[(heading+turn) % 4]
+                        setattr(loc_info, side + '_wall', bool(wall_bits & bit))
+                        setattr(loc_info, side + '_loc', (position[0]+di, position[1]+dj))
+                    rat.location = position
+                    rat.setDirection(heading*90)
+                    expected = np.zeros(4)
+                    for p,turn in rat.getTurnProbabilities(loc_info):
+                        expected[TURN_HEADINGS[turn][heading]] += p
+                    
+                    turns = rat_type.doBatchTurn(np.full(num_samples, wall_bits),
+                                                 np.tile(position, (num_samples,1)),
+                                                 np.full(num_samples, heading), destination, rng)
+                    new_headings = np.array(TURN_HEADINGS)[turns, heading]
+                    found = np.bincount(new_headings, minlength=4) / num_samples
+                    assert(np.abs(found - expected).max() < 0.02)
+    
+    assert(getBatchPolicy(RatBase) is None)
+    
+    class RandomTurnLeftRat(TurnLeftRat):
+        """ Turns at random, so isn't deterministic even though TurnLeftRat is """
+        def doTurn(self, loc_info):
+            if random.random() < 0.5:
+                self.turnLeft()
+    
+    assert(isDeterministic(TurnLeftRat) and not isDeterministic(RandomTurnLeftRat))
+    assert(not goesStraightUntilWall(RandomTurnLeftRat))
+    assert(getBatchPolicy(RandomTurnLeftRat) is None)
     
 
 if __name__ == "__main__":